@@ -1,7 +1,36 @@
-from flask import Flask
+import asyncio
+import logging
+from quart import Quart
 from app.routes import main_bp
+from app.config import WARM_UP
 
-def create_app():
-    app = Flask(__name__)
+def create_app(warm_up=WARM_UP):
+    app = Quart(__name__)
     app.register_blueprint(main_bp)
+    if warm_up:
+        app.before_serving(warm_up_backends)
     return app
+
+async def warm_up_backends():
+    """ Builds the lazily loaded clients up front, a backend that is down
+        is logged and retried on the first request that needs it """
+    from app.db import get_mongo_db, get_chroma_collection
+    from app.lexical import get_lexical_index
+    from app.utils import warm_up_embeddings, get_query_generator
+    from app.orchestrator_agent import get_graph, get_technical_analyst_chain, get_business_analyst_chain, get_report_agent_chain
+
+    loaders = [warm_up_embeddings, get_query_generator, get_graph, get_technical_analyst_chain,
+               get_business_analyst_chain, get_report_agent_chain, get_mongo_db]
+    for loader in loaders:
+        try:
+            await asyncio.to_thread(loader)
+        except Exception as e:
+            logging.error(f"Warm-up of {loader.__name__} failed: {e}")
+    try:
+        await get_chroma_collection()
+    except Exception as e:
+        logging.error(f"Warm-up of the Chroma collection failed: {e}")
+    try:
+        await get_lexical_index()
+    except Exception as e:
+        logging.error(f"Warm-up of the lexical index failed: {e}")
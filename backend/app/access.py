@@ -0,0 +1,37 @@
+from typing import Optional
+from .db import get_employees
+from .config import MAX_ACCESS_LEVEL, SHARED_DEPARTMENTS, ANONYMOUS_ACCESS_LEVEL
+
+
+def parse_access_level(value, default: int = 0) -> int:
+    """ Access levels arrive as ints or strings, missing ones are public (0) """
+    try:
+        return min(max(int(value), 0), MAX_ACCESS_LEVEL)
+    except (TypeError, ValueError):
+        return default
+
+def filter_fields(document: dict) -> dict:
+    """ The fields access_filter matches on, normalized the way the indexes store them """
+    return {
+        "access_level": str(parse_access_level(document.get("access_level"))),
+        "department": str(document.get("department") or "unknown")
+    }
+
+async def get_employee(employee_id: str) -> Optional[dict]:
+    return await get_employees().find_one({"_id": employee_id}, {"corporate_level": 1, "department": 1})
+
+def access_filter(employee: dict) -> dict:
+    """ Chroma `where` clause matching the chunks `employee` may see, so the
+        ANN search only ranks those. Chunk metadata stores the access level
+        as a string, see filter_fields. Without a corporate_level or a
+        department only public chunks of the shared departments match """
+    level = parse_access_level(employee.get("corporate_level"))
+    departments = [employee["department"]] if employee.get("department") else []
+    return {"$and": [
+        {"access_level": {"$in": [str(allowed) for allowed in range(level + 1)]}},
+        {"department": {"$in": list(dict.fromkeys([*departments, *SHARED_DEPARTMENTS]))}}
+    ]}
+
+def anonymous_filter() -> dict:
+    """ Scope of a request without an employee_id, see ANONYMOUS_ACCESS_LEVEL """
+    return access_filter({"corporate_level": ANONYMOUS_ACCESS_LEVEL})
@@ -0,0 +1,140 @@
+import time
+import json
+import sqlite3
+import threading
+from collections import OrderedDict
+import numpy as np
+from .config import RESPONSE_CACHE_THRESHOLD, RESPONSE_CACHE_TTL, RESPONSE_CACHE_SIZE, QUERY_CACHE_SIZE, QUERY_CACHE_PATH
+
+
+class SemanticCache:
+    """ LRU cache with a TTL whose lookups match on the cosine similarity
+        of query embeddings instead of exact keys. Entries only match
+        lookups with the same `scope`, e.g. the caller's access filter.
+        Entries stored under an older `version` of the knowledge base are
+        dropped by the next lookup """
+
+    def __init__(self, threshold=RESPONSE_CACHE_THRESHOLD, ttl=RESPONSE_CACHE_TTL, max_entries=RESPONSE_CACHE_SIZE):
+        self.threshold = threshold
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()  # key -> (unit embedding, value, stored at, scope, version)
+        self._next_key = 0
+        self._lock = threading.Lock()
+
+    def get(self, embedding, scope=None, version=None):
+        if embedding is None:
+            return
+        query = self._normalize(embedding)
+        with self._lock:
+            self._evict_expired()
+            if version is not None:
+                for key in [key for key, entry in self._entries.items() if entry[4] != version]:
+                    del self._entries[key]
+            keys = [key for key, entry in self._entries.items() if entry[3] == scope]
+            if keys:
+                vectors = np.stack([self._entries[key][0] for key in keys])
+                similarities = vectors @ query
+                best = int(np.argmax(similarities))
+                if similarities[best] >= self.threshold:
+                    key = keys[best]
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return self._entries[key][1]
+            self.misses += 1
+
+    def set(self, embedding, value, scope=None, version=None):
+        if embedding is None:
+            return
+        with self._lock:
+            self._entries[self._next_key] = (self._normalize(embedding), value, time.monotonic(), scope, version)
+            self._next_key += 1
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "threshold": self.threshold
+            }
+
+    def _evict_expired(self):
+        now = time.monotonic()
+        expired = [key for key, (_, _, stored_at, _, _) in self._entries.items() if now - stored_at > self.ttl]
+        for key in expired:
+            del self._entries[key]
+
+    @staticmethod
+    def _normalize(embedding):
+        vector = np.asarray(embedding, dtype=np.float32)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
+
+
+class QueryExpansionCache:
+    """ Bounded LRU of the generated RAG-fusion queries keyed on the
+        normalized prompt history, optionally backed by a SQLite file
+        so the expansions survive restarts """
+
+    def __init__(self, max_entries=QUERY_CACHE_SIZE, path=QUERY_CACHE_PATH):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._db = None
+        if path:
+            self._db = sqlite3.connect(path, check_same_thread=False)
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS query_expansions (prompt TEXT PRIMARY KEY, queries TEXT NOT NULL)"
+            )
+            self._db.commit()
+
+    def get(self, prompt):
+        key = self.normalize(prompt)
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                return self._entries[key]
+            if self._db is not None:
+                row = self._db.execute(
+                    "SELECT queries FROM query_expansions WHERE prompt = ?", (key,)
+                ).fetchone()
+                if row:
+                    queries = json.loads(row[0])
+                    self._remember(key, queries)
+                    return queries
+
+    def set(self, prompt, queries):
+        key = self.normalize(prompt)
+        with self._lock:
+            self._remember(key, queries)
+            if self._db is not None:
+                self._db.execute(
+                    "INSERT OR REPLACE INTO query_expansions (prompt, queries) VALUES (?, ?)",
+                    (key, json.dumps(queries))
+                )
+                self._db.commit()
+
+    def _remember(self, key, queries):
+        self._entries[key] = queries
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    @staticmethod
+    def normalize(prompt):
+        return " ".join(prompt.lower().split())
+
+
+response_cache = SemanticCache()
+query_expansion_cache = QueryExpansionCache()
@@ -0,0 +1,45 @@
+from typing import List
+from .lazy import lazy
+from .config import EMBEDDER_MODEL, CHUNK_SIZE, CHUNK_OVERLAP
+
+
+@lazy
+def get_tokenizer():
+    # only the tokenizer, so workers using the shared embedding server don't load the model
+    from transformers import AutoTokenizer
+    name = EMBEDDER_MODEL if "/" in EMBEDDER_MODEL else f"sentence-transformers/{EMBEDDER_MODEL}"
+    return AutoTokenizer.from_pretrained(name)
+
+
+def chunk_text(text: str, chunk_size: int = CHUNK_SIZE, overlap: int = CHUNK_OVERLAP) -> List[str]:
+    """ Splits text into windows of `chunk_size` embedder tokens that overlap
+        by `overlap` tokens, so nothing falls past the model's truncation """
+    offsets = get_tokenizer()(
+        text,
+        add_special_tokens=False,
+        return_offsets_mapping=True
+    )["offset_mapping"]
+    if len(offsets) <= chunk_size:
+        return [text]
+
+    chunks = []
+    step = max(chunk_size - overlap, 1)
+    for start in range(0, len(offsets), step):
+        window = offsets[start:start + chunk_size]
+        chunks.append(text[window[0][0]:window[-1][1]])
+        if start + chunk_size >= len(offsets):
+            break
+    return chunks
+
+def chunk_documents(docs: List[dict]) -> List[dict]:
+    """ Returns the chunks of all the documents, each pointing back to its parent """
+    chunks = []
+    for document in docs:
+        for chunk_index, chunk in enumerate(chunk_text(document["text"])):
+            chunks.append({
+                "_id": f"{document['_id']}#{chunk_index}",
+                "doc_id": document["_id"],
+                "chunk_index": chunk_index,
+                "text": chunk
+            })
+    return chunks
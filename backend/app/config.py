@@ -1,5 +1,6 @@
 from dotenv import load_dotenv
 import os
+import json
 
 load_dotenv()
 
@@ -7,5 +8,74 @@ MONGO_URI = os.getenv("MONGO_URI")
 MONGO_CLIENT = os.getenv("MONGO_CLIENT")
 
 CHROMA_COLLECTION = os.getenv("CHROMA_COLLECTION")
+# http (Chroma server), persistent (embedded Chroma) or numpy (in-process memory-mapped matrix).
+# The embedded modes lock VECTOR_STORE_PATH, only one process (one hypercorn worker) can serve them
+VECTOR_STORE = os.getenv("VECTOR_STORE", "http")
+VECTOR_STORE_PATH = os.getenv("VECTOR_STORE_PATH", "vector_store")
+CHROMA_HOST = os.getenv("CHROMA_HOST", "localhost")
+CHROMA_PORT = int(os.getenv("CHROMA_PORT", 8000))
 
-EMBEDDER_MODEL = 'all-MiniLM-L6-v2'
\ No newline at end of file
+EMBEDDER_MODEL = 'all-MiniLM-L6-v2'
+# torch (FP32), onnx (ONNX Runtime) or onnx-int8 (dynamically quantized ONNX)
+EMBEDDER_BACKEND = os.getenv("EMBEDDER_BACKEND", "torch")
+# prequantized export shipped in the model repo, exported locally when missing
+EMBEDDER_ONNX_INT8_FILE = os.getenv("EMBEDDER_ONNX_INT8_FILE", "onnx/model_quint8_avx2.onnx")
+EMBEDDER_EXPORT_DIR = os.getenv("EMBEDDER_EXPORT_DIR", "embedder_exports")
+
+# Load the embedder, LLM clients and DB handles before serving instead of on first request
+WARM_UP = os.getenv("WARM_UP", "false").lower() in ("1", "true", "yes")
+
+# Semantic cache for /neurocorp responses
+RESPONSE_CACHE_THRESHOLD = float(os.getenv("RESPONSE_CACHE_THRESHOLD", 0.95))  # cosine similarity
+RESPONSE_CACHE_TTL = int(os.getenv("RESPONSE_CACHE_TTL", 60 * 60))  # seconds
+RESPONSE_CACHE_SIZE = int(os.getenv("RESPONSE_CACHE_SIZE", 256))
+
+# RAG-fusion query expansions, QUERY_CACHE_PATH enables the on-disk SQLite store
+QUERY_CACHE_SIZE = int(os.getenv("QUERY_CACHE_SIZE", 1024))
+QUERY_CACHE_PATH = os.getenv("QUERY_CACHE_PATH")
+
+# Bulk ingestion
+INGEST_BATCH_SIZE = int(os.getenv("INGEST_BATCH_SIZE", 512))  # records per insert_many
+EMBED_BATCH_SIZE = int(os.getenv("EMBED_BATCH_SIZE", 64))  # texts per encoder forward pass
+CHROMA_ADD_BATCH_SIZE = int(os.getenv("CHROMA_ADD_BATCH_SIZE", 256))  # vectors per chroma add call
+
+# Embedding service, concurrent encode calls are merged into micro-batches
+EMBEDDING_MAX_BATCH_SIZE = int(os.getenv("EMBEDDING_MAX_BATCH_SIZE", 64))  # texts per micro-batch
+EMBEDDING_MAX_WAIT_MS = float(os.getenv("EMBEDDING_MAX_WAIT_MS", 5))  # how long a batch waits to fill
+# When set, embeddings come from the shared server on this socket (python -m app.embedder)
+EMBEDDING_SOCKET = os.getenv("EMBEDDING_SOCKET")
+# Content-addressed SQLite cache of computed embeddings, set to an empty string to disable
+EMBEDDING_CACHE_PATH = os.getenv("EMBEDDING_CACHE_PATH", "embedding_cache.sqlite3")
+
+# Chunking, in embedder tokens (all-MiniLM-L6-v2 truncates at 256 word-pieces)
+CHUNK_SIZE = int(os.getenv("CHUNK_SIZE", 200))
+CHUNK_OVERLAP = int(os.getenv("CHUNK_OVERLAP", 40))
+
+# Vector hits below this cosine similarity are dropped, RETRIEVAL_THRESHOLDS overrides it
+# per collection as JSON, e.g. {"slack": 0.4}
+RETRIEVAL_MIN_SIMILARITY = float(os.getenv("RETRIEVAL_MIN_SIMILARITY", 0.3))
+RETRIEVAL_THRESHOLDS = json.loads(os.getenv("RETRIEVAL_THRESHOLDS") or "{}")
+# Re-score the vector hits exactly against the chunk vectors in the embedding cache
+RETRIEVAL_EXACT_RESCORE = os.getenv("RETRIEVAL_EXACT_RESCORE", "false").lower() in ("1", "true", "yes")
+
+# Approximate token budget for the knowledge base sent to the analyst prompts
+CONTEXT_TOKEN_BUDGET = int(os.getenv("CONTEXT_TOKEN_BUDGET", 3000))
+
+# BM25 index fused with the vector results, LEXICAL_WEIGHT 0 turns it off
+BM25_K1 = float(os.getenv("BM25_K1", 1.2))
+BM25_B = float(os.getenv("BM25_B", 0.75))
+LEXICAL_WEIGHT = float(os.getenv("LEXICAL_WEIGHT", 1.0))
+# how often a worker adds the documents other workers stored to its index
+LEXICAL_REFRESH_SECONDS = float(os.getenv("LEXICAL_REFRESH_SECONDS", 30))
+
+# Retrieval only searches the chunks the calling employee may see: an access level
+# up to their corporate_level, and their own department or one of the shared ones
+MAX_ACCESS_LEVEL = int(os.getenv("MAX_ACCESS_LEVEL", 5))
+# Nothing authenticates the employee_id a request sends yet, so this filter is
+# advisory: it narrows retrieval for a cooperating client, it does not protect
+# documents from a caller who picks another id. Requests without an employee_id
+# search up to this level, which defaults to everything so the frontend, which
+# only sends an id when one is configured, still finds the collected records.
+# Lower it once callers are authenticated.
+ANONYMOUS_ACCESS_LEVEL = int(os.getenv("ANONYMOUS_ACCESS_LEVEL", MAX_ACCESS_LEVEL))
+SHARED_DEPARTMENTS = [d for d in os.getenv("SHARED_DEPARTMENTS", "unknown,all").split(",") if d]
\ No newline at end of file
@@ -0,0 +1,54 @@
+from typing import List
+from .config import CONTEXT_TOKEN_BUDGET
+
+CHARS_PER_TOKEN = 4  # rough average for English text with the Gemini tokenizer
+MIN_TRUNCATED_TOKENS = 50  # don't bother packing a tail shorter than this
+
+
+def count_tokens(text: str) -> int:
+    return -(-len(text) // CHARS_PER_TOKEN)
+
+def format_header(position: int, document: dict) -> str:
+    fields = [f"[{position}]"]
+    if document.get("source") and document["source"] != "unknown":
+        fields.append(f"source: {document['source']}")
+    if document.get("department") and document["department"] != "unknown":
+        fields.append(f"department: {document['department']}")
+    created_at = document.get("created_at")
+    if created_at:
+        fields.append(f"date: {created_at.date() if hasattr(created_at, 'date') else created_at}")
+    return " | ".join(fields)
+
+def build_context(relevant_documents: List[dict], token_budget: int = CONTEXT_TOKEN_BUDGET) -> str:
+    """ Packs the highest ranked documents, or their matching chunks, into
+        compact text that stays within `token_budget` tokens """
+    if not relevant_documents:
+        return "No relevant documents found."
+
+    sections = []
+    remaining = token_budget
+    for position, document in enumerate(relevant_documents, start=1):
+        header = format_header(position, document)
+        passages = document.get("chunks") or [document.get("text") or ""]
+        remaining -= count_tokens(header) + 1
+        if remaining <= 0:
+            break
+
+        packed = []
+        for passage in passages:
+            cost = count_tokens(passage) + 1
+            if cost <= remaining:
+                packed.append(passage)
+                remaining -= cost
+            elif remaining >= MIN_TRUNCATED_TOKENS:
+                packed.append(passage[:remaining * CHARS_PER_TOKEN].rstrip() + "...")
+                remaining = 0
+                break
+            else:
+                break
+        if packed:
+            sections.append(header + "\n" + "\n...\n".join(packed))
+        if remaining <= 0:
+            break
+
+    return "\n\n".join(sections)
@@ -1,17 +1,58 @@
-from pymongo import MongoClient
-import chromadb
-from chromadb import HttpClient
-from .config import MONGO_URI, MONGO_CLIENT, CHROMA_COLLECTION
-
-
-# MongoDB setup
-mongo_client = MongoClient(MONGO_URI)
-mongo_db = mongo_client[MONGO_CLIENT]
-employees = mongo_db["employees"]
-documents = mongo_db["data"]
-
-# ChromaDB setup
-chroma_client = HttpClient(host="localhost", port=8000)
-chroma_collection = chroma_client.get_or_create_collection(
-    name=CHROMA_COLLECTION,
-    metadata={"hnsw:space": "cosine"})
\ No newline at end of file
+import asyncio
+from .config import MONGO_URI, MONGO_CLIENT, CHROMA_COLLECTION, VECTOR_STORE, VECTOR_STORE_PATH, CHROMA_HOST, CHROMA_PORT
+from .lazy import lazy
+
+
+# MongoDB setup (the client resolves and connects on first use)
+@lazy
+def get_mongo_db():
+    from motor.motor_asyncio import AsyncIOMotorClient
+    mongo_client = AsyncIOMotorClient(MONGO_URI)
+    return mongo_client[MONGO_CLIENT]
+
+def get_employees():
+    return get_mongo_db()["employees"]
+
+def get_documents():
+    return get_mongo_db()["data"]
+
+def get_metadata():
+    return get_mongo_db()["metadata"]
+
+# Version of the knowledge base shared by all workers, every ingest that
+# changes it bumps the version and cached answers of older versions are stale
+async def get_knowledge_base_version() -> int:
+    state = await get_metadata().find_one({"_id": "knowledge_base"}, {"version": 1})
+    return state["version"] if state else 0
+
+async def bump_knowledge_base_version():
+    await get_metadata().update_one({"_id": "knowledge_base"}, {"$inc": {"version": 1}}, upsert=True)
+
+# Vector store setup (the async client has to be created inside the event loop).
+# Every mode exposes Chroma's async collection API: add, upsert, delete, query
+async def open_vector_store():
+    if VECTOR_STORE == "http":
+        import chromadb
+        chroma_client = await chromadb.AsyncHttpClient(host=CHROMA_HOST, port=CHROMA_PORT)
+        return await chroma_client.get_or_create_collection(
+            name=CHROMA_COLLECTION,
+            metadata={"hnsw:space": "cosine"})
+    if VECTOR_STORE == "persistent":
+        from .vector_store import open_persistent_collection
+        return await asyncio.to_thread(open_persistent_collection, VECTOR_STORE_PATH, CHROMA_COLLECTION)
+    if VECTOR_STORE == "numpy":
+        from .vector_store import NumpyCollection
+        return await asyncio.to_thread(NumpyCollection, VECTOR_STORE_PATH)
+    raise ValueError(f"Unknown vector store {VECTOR_STORE!r}, expected http, persistent or numpy")
+
+chroma_collection = None
+_chroma_lock = asyncio.Lock()
+
+async def get_chroma_collection():
+    global chroma_collection
+    if chroma_collection is not None:
+        return chroma_collection
+    async with _chroma_lock:
+        if chroma_collection is None:
+            chroma_collection = await open_vector_store()
+    return chroma_collection
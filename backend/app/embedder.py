@@ -0,0 +1,277 @@
+import os
+import sys
+import json
+import time
+import hashlib
+import sqlite3
+import queue
+import logging
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+from multiprocessing.connection import Listener, Client
+import numpy as np
+from .config import EMBEDDING_MAX_BATCH_SIZE, EMBEDDING_MAX_WAIT_MS, EMBEDDING_SOCKET
+from .config import EMBEDDER_MODEL, EMBEDDER_BACKEND, EMBEDDER_ONNX_INT8_FILE, EMBEDDER_EXPORT_DIR, EMBEDDING_CACHE_PATH
+
+DEFAULT_SOCKET = "/tmp/neurocorp-embeddings.sock"
+
+
+def load_torch(model_name):
+    from sentence_transformers import SentenceTransformer
+    return SentenceTransformer(model_name)
+
+def load_onnx(model_name):
+    from sentence_transformers import SentenceTransformer
+    return SentenceTransformer(model_name, backend="onnx")
+
+def load_onnx_int8(model_name):
+    from sentence_transformers import SentenceTransformer
+    try:
+        return SentenceTransformer(model_name, backend="onnx", model_kwargs={"file_name": EMBEDDER_ONNX_INT8_FILE})
+    except Exception as e:
+        logging.warning(f"No prequantized {EMBEDDER_ONNX_INT8_FILE} for {model_name} ({e}), using a local export")
+    # no prequantized export for this model, quantize it once and reuse the export
+    from sentence_transformers import export_dynamic_quantized_onnx_model
+    export_dir = os.path.join(EMBEDDER_EXPORT_DIR, model_name.replace("/", "_"))
+    # the avx2 config quantizes the weights to QUInt8, the export is named after that
+    export_file = "onnx/model_quint8_avx2.onnx"
+    if not os.path.exists(os.path.join(export_dir, export_file)):
+        model = load_onnx(model_name)
+        model.save(export_dir)
+        export_dynamic_quantized_onnx_model(model, "avx2", export_dir)
+    return SentenceTransformer(export_dir, backend="onnx", model_kwargs={"file_name": export_file})
+
+EMBEDDER_BACKENDS = {
+    "torch": load_torch,
+    "onnx": load_onnx,
+    "onnx-int8": load_onnx_int8,
+}
+
+def load_encoder(backend, model_name):
+    if backend not in EMBEDDER_BACKENDS:
+        raise ValueError(f"Unknown embedder backend {backend!r}, expected one of {', '.join(EMBEDDER_BACKENDS)}")
+    return EMBEDDER_BACKENDS[backend](model_name)
+
+
+class EmbeddingService:
+    """ Collects encode requests from concurrent callers into micro-batches
+        of up to `max_batch_size` texts, waiting at most `max_wait` seconds
+        for a batch to fill, and runs them on one dedicated encoder thread """
+
+    def __init__(self, encode, max_batch_size=EMBEDDING_MAX_BATCH_SIZE, max_wait=EMBEDDING_MAX_WAIT_MS / 1000):
+        self.encode = encode
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait
+        self._requests = queue.Queue()
+        self._thread = None
+        self._lock = threading.Lock()
+
+    def submit(self, texts) -> Future:
+        """ Returns a future resolving to one embedding row per text """
+        future = Future()
+        self._ensure_started()
+        self._requests.put((list(texts), future))
+        return future
+
+    def _ensure_started(self):
+        if self._thread is None:
+            with self._lock:
+                if self._thread is None:
+                    self._thread = threading.Thread(target=self._run, name="embedding-service", daemon=True)
+                    self._thread.start()
+
+    def _next_batch(self):
+        batch = [self._requests.get()]
+        size = len(batch[0][0])
+        deadline = time.monotonic() + self.max_wait
+        while size < self.max_batch_size:
+            timeout = deadline - time.monotonic()
+            if timeout <= 0:
+                break
+            try:
+                request = self._requests.get(timeout=timeout)
+            except queue.Empty:
+                break
+            batch.append(request)
+            size += len(request[0])
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._next_batch()
+            texts = [text for request_texts, _ in batch for text in request_texts]
+            try:
+                embeddings = self.encode(texts)
+            except Exception as e:
+                for _, future in batch:
+                    future.set_exception(e)
+                continue
+            start = 0
+            for request_texts, future in batch:
+                future.set_result(embeddings[start:start + len(request_texts)])
+                start += len(request_texts)
+
+
+class RemoteEmbeddingService:
+    """ Client for an embedding server on a local socket, so several workers
+        can share one copy of the model """
+
+    def __init__(self, address=EMBEDDING_SOCKET, max_connections=8):
+        self.address = address
+        self._pool = ThreadPoolExecutor(max_workers=max_connections, thread_name_prefix="embedding-client")
+        self._local = threading.local()
+
+    def submit(self, texts) -> Future:
+        return self._pool.submit(self._request, list(texts))
+
+    def _request(self, texts):
+        connection = getattr(self._local, "connection", None)
+        if connection is None:
+            connection = self._local.connection = Client(self.address)
+        try:
+            connection.send_bytes(json.dumps(texts).encode())
+            return receive_embeddings(connection)
+        except (EOFError, OSError):
+            # the server restarted, reconnect on the next request
+            self._local.connection = None
+            raise
+
+
+class EmbeddingCache:
+    """ Persistent float32 embeddings keyed by a hash of the model and the
+        whitespace-normalized text, so unchanged text is never encoded twice """
+
+    MAX_VARIABLES = 500  # keep IN (...) lookups under SQLite's parameter limit
+
+    def __init__(self, path, model_id):
+        self.model_id = model_id
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("CREATE TABLE IF NOT EXISTS embeddings (key BLOB PRIMARY KEY, vector BLOB NOT NULL)")
+        self._db.commit()
+
+    def key(self, text):
+        normalized = " ".join(text.split())
+        return hashlib.sha256(f"{self.model_id}\0{normalized}".encode()).digest()
+
+    def get_many(self, texts):
+        """ Returns the cached vector of every text, None where there is none """
+        keys = [self.key(text) for text in texts]
+        found = {}
+        with self._lock:
+            for start in range(0, len(keys), self.MAX_VARIABLES):
+                batch = keys[start:start + self.MAX_VARIABLES]
+                rows = self._db.execute(
+                    f"SELECT key, vector FROM embeddings WHERE key IN ({','.join('?' * len(batch))})", batch
+                ).fetchall()
+                found.update(rows)
+        return [np.frombuffer(found[key], dtype=np.float32) if key in found else None for key in keys]
+
+    def put_many(self, texts, embeddings):
+        rows = [
+            (self.key(text), np.asarray(embedding, dtype=np.float32).tobytes())
+            for text, embedding in zip(texts, embeddings)
+        ]
+        with self._lock:
+            self._db.executemany("INSERT OR REPLACE INTO embeddings (key, vector) VALUES (?, ?)", rows)
+            self._db.commit()
+
+
+class CachedEmbeddingService:
+    """ Answers from the embedding cache and only submits the misses. The
+        lookups and writes hash every text and wait on SQLite, they run on
+        the cache's own thread so submit never blocks the caller (the event
+        loop of a worker) """
+
+    def __init__(self, service, cache):
+        self.service = service
+        self.cache = cache
+        self._pool = ThreadPoolExecutor(max_workers=1, thread_name_prefix="embedding-cache")
+
+    def submit(self, texts) -> Future:
+        result = Future()
+        self._pool.submit(self._lookup, list(texts), result)
+        return result
+
+    def _lookup(self, texts, result):
+        try:
+            embeddings = self.cache.get_many(texts)
+        except Exception as e:
+            result.set_exception(e)
+            return
+        missing = [i for i, embedding in enumerate(embeddings) if embedding is None]
+        if not missing:
+            result.set_result(np.stack(embeddings))
+            return
+
+        missing_texts = [texts[i] for i in missing]
+
+        def on_encoded(future):
+            try:
+                encoded = future.result()
+            except Exception as e:
+                result.set_exception(e)
+                return
+            for i, embedding in zip(missing, encoded):
+                embeddings[i] = np.asarray(embedding, dtype=np.float32)
+            result.set_result(np.stack(embeddings))
+            self._pool.submit(self._store, missing_texts, encoded)
+
+        self.service.submit(missing_texts).add_done_callback(on_encoded)
+
+    def _store(self, texts, embeddings):
+        try:
+            self.cache.put_many(texts, embeddings)
+        except Exception as e:
+            logging.warning(f"Writing {len(texts)} embeddings to the cache failed: {e}")
+
+
+def with_embedding_cache(service, path=EMBEDDING_CACHE_PATH):
+    if not path:
+        return service
+    return CachedEmbeddingService(service, EmbeddingCache(path, f"{EMBEDDER_MODEL}:{EMBEDDER_BACKEND}"))
+
+
+def send_embeddings(connection, embeddings):
+    embeddings = np.ascontiguousarray(embeddings, dtype=np.float32)
+    connection.send_bytes(json.dumps({"shape": embeddings.shape}).encode())
+    connection.send_bytes(embeddings.tobytes())
+
+def receive_embeddings(connection):
+    header = json.loads(connection.recv_bytes())
+    if "error" in header:
+        raise RuntimeError(header["error"])
+    return np.frombuffer(connection.recv_bytes(), dtype=np.float32).reshape(header["shape"])
+
+def handle_connection(connection, service):
+    with connection:
+        while True:
+            try:
+                texts = json.loads(connection.recv_bytes())
+            except EOFError:
+                return
+            try:
+                embeddings = service.submit(texts).result()
+            except Exception as e:
+                connection.send_bytes(json.dumps({"error": str(e)}).encode())
+                continue
+            send_embeddings(connection, embeddings)
+
+def serve(address=EMBEDDING_SOCKET or DEFAULT_SOCKET):
+    """ Loads the model once and serves micro-batched embeddings on `address` """
+    from .utils import encode_batch
+
+    service = with_embedding_cache(EmbeddingService(encode_batch))
+    encode_batch(["warm up"])
+    with Listener(address) as listener:
+        logging.info(f"Embedding server listening on {address}")
+        while True:
+            connection = listener.accept()
+            threading.Thread(target=handle_connection, args=(connection, service), daemon=True).start()
+
+
+# python -m app.embedder [socket path]
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    serve(sys.argv[1] if len(sys.argv) > 1 else EMBEDDING_SOCKET or DEFAULT_SOCKET)
@@ -0,0 +1,211 @@
+import json
+import asyncio
+import hashlib
+import logging
+from typing import List, Tuple
+from pymongo import UpdateOne
+from pymongo.errors import BulkWriteError
+from .db import get_documents, get_chroma_collection, bump_knowledge_base_version
+from .utils import generate_uuid, get_timestamp, aembedd_texts
+from .chunking import chunk_documents
+from .access import filter_fields
+from .lexical import lexical_index
+from .config import INGEST_BATCH_SIZE, CHROMA_ADD_BATCH_SIZE
+
+
+# fields that make up a document's content, a change in any of them re-indexes it
+HASHED_FIELDS = ("text", "department", "source", "employees", "access_level", "company_name")
+
+
+def document_id(data):
+    source_id = data.get("source_id")
+    if source_id:
+        # the same Slack message or email always maps to the same document
+        return f"data_{hashlib.sha256(str(source_id).encode()).hexdigest()[:16]}"
+    return generate_uuid("data")
+
+def content_hash(document):
+    fields = {field: document.get(field) for field in HASHED_FIELDS}
+    return hashlib.sha256(json.dumps(fields, sort_keys=True, default=str).encode()).hexdigest()
+
+def build_document(data):
+    doc_text = data.get("text") if isinstance(data, dict) else None
+    if not doc_text or not isinstance(doc_text, str):
+        return
+    document = {
+        "_id": document_id(data),
+        "source_id": data.get("source_id"),
+        "text": doc_text,
+        "department": data.get("department", "unknown"),
+        "source": data.get("source", "unknown"),
+        "created_at": get_timestamp(),
+        "employees": data.get("employees"),
+        "access_level": data.get("access_level"),
+        "company_name": data.get("company_name", "unknown")
+    }
+    document["content_hash"] = content_hash(document)
+    return document
+
+def build_metadata(document, chunk):
+    return {
+        "doc_id": document["_id"],
+        "chunk_index": chunk["chunk_index"],
+        **filter_fields(document)
+    }
+
+async def index_documents(docs: List[dict], replaced_ids: List[str] = None) -> bool:
+    """ Chunks and embeds the documents and upserts the chunk vectors to Chroma,
+        dropping the old chunks of `replaced_ids` first """
+    chunks = await asyncio.to_thread(chunk_documents, docs)
+    embeddings = await aembedd_texts([chunk["text"] for chunk in chunks])
+    if embeddings is None:
+        return False
+
+    documents_by_id = {document["_id"]: document for document in docs}
+    chroma_collection = await get_chroma_collection()
+    if replaced_ids:
+        # a changed document can have fewer chunks than before
+        await chroma_collection.delete(where={"doc_id": {"$in": list(replaced_ids)}})
+    for start in range(0, len(chunks), CHROMA_ADD_BATCH_SIZE):
+        batch = chunks[start:start + CHROMA_ADD_BATCH_SIZE]
+        await chroma_collection.upsert(
+            ids=[chunk["_id"] for chunk in batch],
+            documents=[chunk["text"] for chunk in batch],
+            metadatas=[build_metadata(documents_by_id[chunk["doc_id"]], chunk) for chunk in batch],
+            embeddings=embeddings[start:start + CHROMA_ADD_BATCH_SIZE]
+        )
+    return True
+
+async def upsert_documents(docs: List[dict]) -> dict:
+    """ Upserts the documents into Mongo, keeping the original created_at,
+        and returns the error message of every document that failed.
+        updated_at is set from the server clock, the lexical index of every
+        worker picks up the documents by it """
+    operations = []
+    for document in docs:
+        fields = {key: value for key, value in document.items() if key not in ("_id", "created_at")}
+        operations.append(UpdateOne(
+            {"_id": document["_id"]},
+            {
+                "$set": fields,
+                "$setOnInsert": {"created_at": document["created_at"]},
+                "$currentDate": {"updated_at": True}
+            },
+            upsert=True
+        ))
+    failed = {}
+    try:
+        await get_documents().bulk_write(operations, ordered=False)
+    except BulkWriteError as e:
+        for error in e.details.get("writeErrors", []):
+            failed[docs[error["index"]]["_id"]] = error.get("errmsg", "Failed to store document.")
+    return failed
+
+async def ingest_batch(batch: List[Tuple[int, dict]], dry_run: bool = False) -> List[dict]:
+    """ Upserts a batch of (index, record) pairs and returns one result per
+        record with its status: new, changed, unchanged or duplicate. Of the
+        records sharing a source_id the last one is stored, the earlier ones
+        are duplicates. A record that failed has an error instead, marked
+        retryable when it failed on our side (indexing or storage) rather
+        than for being invalid """
+    results = []
+    docs = {}
+    for index, data in batch:
+        document = build_document(data)
+        if document is None:
+            results.append({"index": index, "error": "No document text received."})
+        else:
+            if document["_id"] in docs:
+                # the later record is the newer version, the earlier one is dropped
+                earlier_index, _ = docs.pop(document["_id"])
+                results.append({"index": earlier_index, "id": document["_id"], "status": "duplicate"})
+            docs[document["_id"]] = (index, document)
+    if not docs:
+        return results
+
+    existing = await get_documents().find(
+        {"_id": {"$in": list(docs)}}, {"content_hash": 1}
+    ).to_list(length=None)
+    stored_hashes = {document["_id"]: document.get("content_hash") for document in existing}
+
+    statuses = {}
+    for doc_id, (_, document) in docs.items():
+        if doc_id not in stored_hashes:
+            statuses[doc_id] = "new"
+        elif stored_hashes[doc_id] != document["content_hash"]:
+            statuses[doc_id] = "changed"
+        else:
+            statuses[doc_id] = "unchanged"
+
+    to_write = [document for doc_id, (_, document) in docs.items() if statuses[doc_id] != "unchanged"]
+    failed = {}
+    if to_write and not dry_run:
+        # vectors first, so a document whose content hash is stored is always indexed
+        replaced_ids = [document["_id"] for document in to_write if statuses[document["_id"]] == "changed"]
+        try:
+            indexed = await index_documents(to_write, replaced_ids)
+        except Exception as e:
+            logging.error(f"Failed to index documents: {e}")
+            indexed = False
+        if indexed:
+            failed = await upsert_documents(to_write)
+            stored = [document for document in to_write if document["_id"] not in failed]
+            await asyncio.to_thread(lexical_index.add, stored)
+            if stored:
+                # cached answers of every worker predate these documents
+                await bump_knowledge_base_version()
+        else:
+            failed = {document["_id"]: "Failed to index document." for document in to_write}
+
+    for doc_id, (index, _) in docs.items():
+        if doc_id in failed:
+            results.append({"index": index, "error": failed[doc_id], "retryable": True})
+        else:
+            results.append({"index": index, "id": doc_id, "status": statuses[doc_id]})
+    return results
+
+async def ingest_records(records, dry_run: bool = False) -> List[dict]:
+    """ Ingests an iterable or async iterable of records in INGEST_BATCH_SIZE batches """
+    if not hasattr(records, "__aiter__"):
+        records = iterate(records)
+    results = []
+    batch = []
+    index = 0
+    async for data in records:
+        batch.append((index, data))
+        index += 1
+        if len(batch) >= INGEST_BATCH_SIZE:
+            results.extend(await ingest_batch(batch, dry_run))
+            batch = []
+    if batch:
+        results.extend(await ingest_batch(batch, dry_run))
+    return sorted(results, key=lambda result: result["index"])
+
+def summarize_results(results: List[dict]) -> dict:
+    summary = {"new": 0, "changed": 0, "unchanged": 0, "duplicate": 0, "failed": 0}
+    for result in results:
+        summary[result.get("status", "failed")] += 1
+    return summary
+
+async def iterate(records):
+    for data in records:
+        yield data
+
+async def iter_ndjson(body):
+    """ Parses an NDJSON request body as it streams in, one record per line """
+    buffer = b""
+    async for chunk in body:
+        buffer += chunk
+        *lines, buffer = buffer.split(b"\n")
+        for line in lines:
+            if line.strip():
+                yield parse_ndjson_line(line)
+    if buffer.strip():
+        yield parse_ndjson_line(buffer)
+
+def parse_ndjson_line(line):
+    try:
+        return json.loads(line)
+    except ValueError:
+        # ingest_batch reports it as a record without text
+        return None
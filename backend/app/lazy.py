@@ -0,0 +1,20 @@
+import threading
+import functools
+
+
+def lazy(factory):
+    """ Turns a zero-argument factory into a thread-safe getter that builds
+        the value on the first call and returns the same object afterwards """
+    lock = threading.Lock()
+    instance = []
+
+    @functools.wraps(factory)
+    def getter():
+        if not instance:
+            with lock:
+                if not instance:
+                    instance.append(factory())
+        return instance[0]
+
+    getter.is_loaded = lambda: bool(instance)
+    return getter
@@ -0,0 +1,268 @@
+import re
+import math
+import time
+import asyncio
+import logging
+import threading
+from datetime import timedelta
+from array import array
+from collections import Counter
+import numpy as np
+from .db import get_documents
+from .access import filter_fields
+from .config import BM25_K1, BM25_B, INGEST_BATCH_SIZE, LEXICAL_REFRESH_SECONDS
+
+# Documents stored within this long before the newest one seen are read
+# again on refresh, writes of other workers can commit out of order
+REFRESH_OVERLAP = timedelta(seconds=60)
+LOADED_FIELDS = {"text": 1, "access_level": 1, "department": 1, "updated_at": 1}
+
+TOKEN_PATTERN = re.compile(r"[a-z0-9]+(?:[-_./][a-z0-9]+)*")
+TOKEN_SEPARATORS = re.compile(r"[-_./]")
+STOPWORDS = frozenset(
+    "a an and are as at be but by for from has have in is it its of on or that the this to was were will with".split()
+)
+
+
+def tokenize(text: str) -> list:
+    """ Lowercased word tokens. Compound tokens such as ticket ids, file names or
+        channel names (sqlalchemy-to-ibis-migration) are kept whole and also
+        split into their parts, so both the exact name and its words match """
+    tokens = []
+    for match in TOKEN_PATTERN.finditer(text.lower()):
+        token = match.group()
+        if token not in STOPWORDS:
+            tokens.append(token)
+        if not token.isalnum():
+            tokens.extend(part for part in TOKEN_SEPARATORS.split(token) if part and part not in STOPWORDS)
+    return tokens
+
+
+class LexicalIndex:
+    """ In-memory BM25 index over the document texts. Every term has two
+        int32 arrays, the numbers of the documents it occurs in and its
+        frequency in each. A re-ingested document is tombstoned and appended
+        again, and the arrays are compacted once most postings are dead """
+
+    MIN_DEAD_TO_COMPACT = 1000
+
+    def __init__(self, k1=BM25_K1, b=BM25_B):
+        self.k1 = k1
+        self.b = b
+        self.loaded = False
+        self.synced_at = None  # newest updated_at of the stored documents read so far
+        self.refreshed_at = 0.0
+        self._recent = {}  # _id -> updated_at of the documents read within REFRESH_OVERLAP of synced_at
+        self._lock = threading.Lock()
+        self._reset()
+
+    def _reset(self):
+        self._postings = {}  # term -> (document numbers, term frequencies)
+        self._ids = []  # document number -> _id
+        self._numbers = {}  # _id -> number of its live copy
+        self._lengths = array("i")
+        self._live = bytearray()
+        self._levels = array("b")  # access level of every document number
+        self._departments = array("i")  # department code of every document number
+        self._department_codes = {}
+        self._total_length = 0
+        self._dead = 0
+
+    def __len__(self):
+        return len(self._numbers)
+
+    def add(self, documents, replace=True):
+        """ Indexes the documents, replacing the earlier copy of a known _id
+            unless `replace` is False """
+        tokenized = [(document, Counter(tokenize(document.get("text") or ""))) for document in documents]
+        with self._lock:
+            for document, counts in tokenized:
+                doc_id = document["_id"]
+                if doc_id in self._numbers:
+                    if not replace:
+                        continue
+                    self._remove(doc_id)
+                number = len(self._ids)
+                length = sum(counts.values())
+                fields = filter_fields(document)
+                self._ids.append(doc_id)
+                self._numbers[doc_id] = number
+                self._lengths.append(length)
+                self._live.append(1)
+                self._levels.append(int(fields["access_level"]))
+                self._departments.append(
+                    self._department_codes.setdefault(fields["department"], len(self._department_codes))
+                )
+                self._total_length += length
+                for term, frequency in counts.items():
+                    numbers, frequencies = self._postings.setdefault(term, (array("i"), array("i")))
+                    numbers.append(number)
+                    frequencies.append(frequency)
+            if self._dead >= self.MIN_DEAD_TO_COMPACT and self._dead > len(self._numbers):
+                self._compact()
+
+    def search(self, query: str, top_k: int, where: dict = None) -> list:
+        """ The _ids of the `top_k` best BM25 matches of `query`, best first.
+            `where` takes the Chroma filters built by access.access_filter """
+        terms = set(tokenize(query))
+        with self._lock:
+            if not terms or not self._numbers:
+                return []
+            live = np.frombuffer(self._live, dtype=np.uint8).astype(bool)
+            allowed = live & self._filter_mask(where) if where else live
+            lengths = np.frombuffer(self._lengths, dtype=np.int32)
+            num_documents = len(self._numbers)
+            average_length = self._total_length / num_documents or 1.0
+
+            scores = np.zeros(len(self._ids), dtype=np.float32)
+            for term in terms:
+                postings = self._postings.get(term)
+                if postings is None:
+                    continue
+                numbers = np.frombuffer(postings[0], dtype=np.int32)
+                frequencies = np.frombuffer(postings[1], dtype=np.int32).astype(np.float32)
+                document_frequency = int(np.count_nonzero(live[numbers]))
+                if not document_frequency:
+                    continue
+                idf = math.log(1 + (num_documents - document_frequency + 0.5) / (document_frequency + 0.5))
+                norms = self.k1 * (1 - self.b + self.b * lengths[numbers] / average_length)
+                # a document occurs once in the postings of a term, so the fancy += is safe
+                scores[numbers] += idf * frequencies * (self.k1 + 1) / (frequencies + norms)
+
+            scores[~allowed] = 0
+            candidates = np.flatnonzero(scores)
+            if len(candidates) > top_k:
+                candidates = candidates[np.argpartition(-scores[candidates], top_k - 1)[:top_k]]
+            ranked = candidates[np.argsort(-scores[candidates], kind="stable")]
+            return [self._ids[number] for number in ranked]
+
+    def _filter_mask(self, where):
+        """ Evaluates the subset of Chroma's `where` syntax the access filter
+            uses: $and, $or, $in, $nin, $eq, $ne and plain equality on
+            access_level and department """
+        if "$and" in where:
+            mask = np.ones(len(self._ids), dtype=bool)
+            for condition in where["$and"]:
+                mask &= self._filter_mask(condition)
+            return mask
+        if "$or" in where:
+            mask = np.zeros(len(self._ids), dtype=bool)
+            for condition in where["$or"]:
+                mask |= self._filter_mask(condition)
+            return mask
+
+        mask = np.ones(len(self._ids), dtype=bool)
+        for field, condition in where.items():
+            if field == "access_level":
+                values = np.frombuffer(self._levels, dtype=np.int8)
+                encode = int
+            elif field == "department":
+                values = np.frombuffer(self._departments, dtype=np.int32)
+                encode = lambda department: self._department_codes.get(department, -1)
+            else:
+                raise ValueError(f"The lexical index can't filter on {field!r}")
+            if not isinstance(condition, dict):
+                condition = {"$eq": condition}
+            for operator, operand in condition.items():
+                if operator == "$eq":
+                    mask &= values == encode(operand)
+                elif operator == "$ne":
+                    mask &= values != encode(operand)
+                elif operator == "$in":
+                    mask &= np.isin(values, [encode(value) for value in operand])
+                elif operator == "$nin":
+                    mask &= ~np.isin(values, [encode(value) for value in operand])
+                else:
+                    raise ValueError(f"The lexical index doesn't support {operator}")
+        return mask
+
+    def _remove(self, doc_id):
+        number = self._numbers.pop(doc_id)
+        self._live[number] = 0
+        self._total_length -= self._lengths[number]
+        self._dead += 1
+
+    def _compact(self):
+        """ Renumbers the live documents and drops the postings of the dead ones """
+        live = np.frombuffer(self._live, dtype=np.uint8).astype(bool)
+        renumber = np.full(len(live), -1, dtype=np.int32)
+        kept = np.flatnonzero(live)
+        renumber[kept] = np.arange(len(kept), dtype=np.int32)
+
+        postings = {}
+        for term, (numbers, frequencies) in self._postings.items():
+            old_numbers = renumber[np.frombuffer(numbers, dtype=np.int32)]
+            keep = old_numbers >= 0
+            if not keep.any():
+                continue
+            new_numbers, new_frequencies = array("i"), array("i")
+            new_numbers.frombytes(old_numbers[keep].tobytes())
+            new_frequencies.frombytes(np.frombuffer(frequencies, dtype=np.int32)[keep].tobytes())
+            postings[term] = (new_numbers, new_frequencies)
+
+        ids = [self._ids[number] for number in kept]
+        lengths = array("i", (self._lengths[number] for number in kept))
+        levels = array("b", (self._levels[number] for number in kept))
+        departments = array("i", (self._departments[number] for number in kept))
+        self._postings = postings
+        self._ids = ids
+        self._numbers = {doc_id: number for number, doc_id in enumerate(ids)}
+        self._lengths = lengths
+        self._live = bytearray([1]) * len(ids)
+        self._levels = levels
+        self._departments = departments
+        self._dead = 0
+
+
+lexical_index = LexicalIndex()
+_load_lock = asyncio.Lock()
+
+async def load_stored(query, replace):
+    """ Adds the stored documents matching `query`, skipping the ones already
+        read at the same updated_at, and remembers the newest updated_at """
+    versions = {}
+    batch = []
+    async for document in get_documents().find(query, LOADED_FIELDS):
+        updated_at = document.get("updated_at")
+        if updated_at is not None:
+            if lexical_index._recent.get(document["_id"]) == updated_at:
+                continue
+            versions[document["_id"]] = updated_at
+        batch.append(document)
+        if len(batch) >= INGEST_BATCH_SIZE:
+            await asyncio.to_thread(lexical_index.add, batch, replace)
+            batch = []
+    if batch:
+        await asyncio.to_thread(lexical_index.add, batch, replace)
+
+    newest = max(versions.values(), default=None)
+    if newest is not None and (lexical_index.synced_at is None or newest > lexical_index.synced_at):
+        lexical_index.synced_at = newest
+    if lexical_index.synced_at is not None:
+        since = lexical_index.synced_at - REFRESH_OVERLAP
+        recent = {**lexical_index._recent, **versions}
+        lexical_index._recent = {doc_id: updated_at for doc_id, updated_at in recent.items() if updated_at > since}
+    lexical_index.refreshed_at = time.monotonic()
+
+async def get_lexical_index() -> LexicalIndex:
+    """ Builds the index from the stored documents on first use, documents
+        ingested meanwhile are newer and keep their indexed copy. Every
+        LEXICAL_REFRESH_SECONDS the documents other workers stored since are
+        read by their updated_at, see ingest.upsert_documents """
+    if not lexical_index.loaded:
+        async with _load_lock:
+            if not lexical_index.loaded:
+                await load_stored({}, False)
+                lexical_index.loaded = True
+    elif time.monotonic() - lexical_index.refreshed_at >= LEXICAL_REFRESH_SECONDS and not _load_lock.locked():
+        # one refresh at a time, searches meanwhile use the index as it is
+        async with _load_lock:
+            try:
+                if lexical_index.synced_at is None:
+                    await load_stored({"updated_at": {"$exists": True}}, True)
+                else:
+                    await load_stored({"updated_at": {"$gt": lexical_index.synced_at - REFRESH_OVERLAP}}, True)
+            except Exception as e:
+                lexical_index.refreshed_at = time.monotonic()
+                logging.warning(f"Refreshing the lexical index failed: {e}")
+    return lexical_index
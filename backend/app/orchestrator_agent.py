@@ -1,14 +1,16 @@
+import asyncio
 from dotenv import load_dotenv
 from typing import TypedDict, List, Dict, Any
 from langchain_core.prompts import ChatPromptTemplate
-from langchain_google_genai import ChatGoogleGenerativeAI
 from langchain_core.output_parsers import StrOutputParser
-
-from langgraph.graph import StateGraph, END
+from .lazy import lazy
 
 load_dotenv() # to load gemini API key
 
-llm = ChatGoogleGenerativeAI(model="gemini-2.0-flash", temperature=0.7)
+@lazy
+def get_llm():
+    from langchain_google_genai import ChatGoogleGenerativeAI
+    return ChatGoogleGenerativeAI(model="gemini-2.0-flash", temperature=0.7)
 
 class OrchestrationState(TypedDict):
     raw_chat_history: List[List[str]]
@@ -48,7 +50,9 @@ technical_analyst_prompt = ChatPromptTemplate.from_messages([
     ("system", technical_analyst_system_prompt),
     ("human", technical_analyst_human_template)
 ])
-technical_analyst_chain = technical_analyst_prompt | llm | StrOutputParser()
+@lazy
+def get_technical_analyst_chain():
+    return technical_analyst_prompt | get_llm() | StrOutputParser()
 
 # Business Analyst Agent
 business_analyst_system_prompt = (
@@ -73,7 +77,9 @@ business_analyst_prompt = ChatPromptTemplate.from_messages([
     ("system", business_analyst_system_prompt),
     ("human", business_analyst_human_template)
 ])
-business_analyst_chain = business_analyst_prompt | llm | StrOutputParser()
+@lazy
+def get_business_analyst_chain():
+    return business_analyst_prompt | get_llm() | StrOutputParser()
 
 # Report Agent
 report_agent_system_prompt = (
@@ -102,7 +108,9 @@ report_agent_prompt = ChatPromptTemplate.from_messages([
     ("system", report_agent_system_prompt),
     ("human", report_agent_human_template)
 ])
-report_agent_chain = report_agent_prompt | llm | StrOutputParser()
+@lazy
+def get_report_agent_chain():
+    return report_agent_prompt | get_llm() | StrOutputParser()
 
 
 # 5. Define Nodes for the Graph
@@ -119,27 +127,27 @@ def prepare_input_node(state: OrchestrationState) -> Dict[str, Any]:
     
     return {"current_query": current_query}
 
-def technical_analyst_node(state: OrchestrationState) -> Dict[str, str]:
+async def technical_analyst_node(state: OrchestrationState) -> Dict[str, str]:
     formatted_history = format_chat_history_for_prompt(state["raw_chat_history"])
-    analysis = technical_analyst_chain.invoke({
+    analysis = await get_technical_analyst_chain().ainvoke({
         "current_query": state["current_query"],
         "formatted_chat_history": formatted_history,
         "knowledge_base_data": state["knowledge_base_data"]
     })
     return {"technical_analysis": analysis}
 
-def business_analyst_node(state: OrchestrationState) -> Dict[str, str]:
+async def business_analyst_node(state: OrchestrationState) -> Dict[str, str]:
     formatted_history = format_chat_history_for_prompt(state["raw_chat_history"])
-    analysis = business_analyst_chain.invoke({
+    analysis = await get_business_analyst_chain().ainvoke({
         "current_query": state["current_query"],
         "formatted_chat_history": formatted_history,
         "knowledge_base_data": state["knowledge_base_data"]
     })
     return {"business_analysis": analysis}
 
-def report_agent_node(state: OrchestrationState) -> Dict[str, str]:
+async def report_agent_node(state: OrchestrationState) -> Dict[str, str]:
     formatted_history = format_chat_history_for_prompt(state["raw_chat_history"])
-    report = report_agent_chain.invoke({
+    report = await get_report_agent_chain().ainvoke({
         "current_query": state["current_query"],
         "formatted_chat_history": formatted_history,
         "technical_analysis": state["technical_analysis"],
@@ -148,33 +156,38 @@ def report_agent_node(state: OrchestrationState) -> Dict[str, str]:
     return {"final_report": report}
 
 # 6. Construct the Graph (Orchestration Workflow)
-workflow = StateGraph(OrchestrationState)
+@lazy
+def get_graph():
+    from langgraph.graph import StateGraph, END
+
+    workflow = StateGraph(OrchestrationState)
 
-# Add nodes
-workflow.add_node("prepare_inputs", prepare_input_node)
-workflow.add_node("technical_analyst", technical_analyst_node)
-workflow.add_node("business_analyst", business_analyst_node)
-workflow.add_node("report_agent", report_agent_node)
+    # Add nodes
+    workflow.add_node("prepare_inputs", prepare_input_node)
+    workflow.add_node("technical_analyst", technical_analyst_node)
+    workflow.add_node("business_analyst", business_analyst_node)
+    workflow.add_node("report_agent", report_agent_node)
 
-# Set entry point
-workflow.set_entry_point("prepare_inputs")
+    # Set entry point
+    workflow.set_entry_point("prepare_inputs")
 
-# Add sequential edges
-workflow.add_edge("prepare_inputs", "technical_analyst")
-workflow.add_edge("technical_analyst", "business_analyst")
-workflow.add_edge("business_analyst", "report_agent")
-workflow.add_edge("report_agent", END)
+    # Fan out to both analysts (they only depend on the prepared inputs),
+    # then fan back in so the report agent waits for both analyses
+    workflow.add_edge("prepare_inputs", "technical_analyst")
+    workflow.add_edge("prepare_inputs", "business_analyst")
+    workflow.add_edge(["technical_analyst", "business_analyst"], "report_agent")
+    workflow.add_edge("report_agent", END)
 
-# Compile the workflow
-app = workflow.compile()
+    # Compile the workflow
+    return workflow.compile()
 
 # 7. Run the Orchestration Workflow
 
-def run_orchestration(
+def build_initial_state(
     raw_chat_history: List[List[str]], 
     knowledge_base_data: str
-) -> str:
-    initial_state = {
+) -> OrchestrationState:
+    return {
         "raw_chat_history": raw_chat_history,
         "knowledge_base_data": knowledge_base_data,
         "current_query": "", 
@@ -182,15 +195,51 @@ def run_orchestration(
         "business_analysis": "",
         "final_report": ""
     }
+
+def is_valid_report(final_state) -> bool:
+    return bool(final_state and final_state.get("final_report") and final_state.get("final_report") != "cannot generate response")
+
+async def run_orchestration(
+    raw_chat_history: List[List[str]], 
+    knowledge_base_data: str
+) -> str:
+    initial_state = build_initial_state(raw_chat_history, knowledge_base_data)
     
-    final_state = app.invoke(initial_state, {"recursion_limit": 10})
+    final_state = await get_graph().ainvoke(initial_state, {"recursion_limit": 10})
     
     
-    if final_state and final_state.get("final_report") and final_state.get("final_report") != "cannot generate response":
+    if is_valid_report(final_state):
         return final_state
     else:
         return "Error: Could not generate report."
 
+async def stream_orchestration(
+    raw_chat_history: List[List[str]], 
+    knowledge_base_data: str
+):
+    """ Runs the workflow and yields an event each time a node finishes,
+        the report agent's output token by token, and the final state """
+    final_state = build_initial_state(raw_chat_history, knowledge_base_data)
+
+    async for mode, chunk in get_graph().astream(
+        final_state,
+        {"recursion_limit": 10},
+        stream_mode=["updates", "messages"]
+    ):
+        if mode == "messages":
+            message, metadata = chunk
+            if metadata.get("langgraph_node") == "report_agent" and isinstance(message.content, str) and message.content:
+                yield {"event": "report_token", "content": message.content}
+        else:
+            for node, update in chunk.items():
+                final_state.update(update or {})
+                yield {"event": "node_finished", "node": node, **(update or {})}
+
+    if is_valid_report(final_state):
+        yield {"event": "done", "result": final_state}
+    else:
+        yield {"event": "error", "error": "Error: Could not generate report."}
+
 from pprint import pprint
 # Example Usage:
 if __name__ == "__main__":
@@ -206,7 +255,7 @@ if __name__ == "__main__":
         "Competitor apps often lack personalized financial advice. Technology trends point towards using federated learning for privacy-preserving AI features."
     )
 
-    final_report_output = run_orchestration(sample_chat_history, sample_knowledge_base_data)
+    final_report_output = asyncio.run(run_orchestration(sample_chat_history, sample_knowledge_base_data))
 
     sample_chat_history_2 = [
         ["user", "What are the pros and cons of using Python for web development?"]
@@ -218,7 +267,7 @@ if __name__ == "__main__":
         "sometimes slower performance compared to languages like Go or Java for specific use cases. "
         "Excellent for AI/ML integration."
     )
-    final_report_output_2 = run_orchestration(sample_chat_history_2, sample_knowledge_base_data_2)
+    final_report_output_2 = asyncio.run(run_orchestration(sample_chat_history_2, sample_knowledge_base_data_2))
 
     
     sample_chat_history_3 = [
@@ -227,4 +276,4 @@ if __name__ == "__main__":
     sample_knowledge_base_data_3 = (
         "no relevant data "
     )
-    final_report_output_3 = run_orchestration(sample_chat_history_3, sample_knowledge_base_data_3)
\ No newline at end of file
+    final_report_output_3 = asyncio.run(run_orchestration(sample_chat_history_3, sample_knowledge_base_data_3))
\ No newline at end of file
@@ -1,22 +1,26 @@
-from flask import Blueprint, request, jsonify
-from app.db import employees, documents, chroma_collection
-from app.utils import generate_uuid, get_timestamp, embedd_text, retrieve_from_db
-from .orchestrator_agent import run_orchestration
+import json
+from quart import Blueprint, request, jsonify
+from app.db import get_employees, get_knowledge_base_version
+from app.utils import generate_uuid, aembedd_text, retrieve_from_db, combine_user_prompts
+from app.cache import response_cache
+from app.access import get_employee, access_filter, anonymous_filter
+from app.ingest import ingest_batch, ingest_records, iter_ndjson, summarize_results
+from .orchestrator_agent import run_orchestration, stream_orchestration
 from .config import MONGO_URI
 main_bp = Blueprint('main', __name__)
 
 @main_bp.route('/', methods=['GET'])
-def welcome_route():
+async def welcome_route():
     return "Welcome to the backend"
 
 @main_bp.route('/add_employee', methods=['POST'])
-def add_employee():
-    data = request.json
+async def add_employee():
+    data = await request.get_json()
 
     if not data.get("email") or not data.get("username"):
         return jsonify({"error": "Email and username are required."}), 400
     
-    if employees.find_one({"$or": [{"email": data.get("email")}, {"username": data.get("username")}]}):
+    if await get_employees().find_one({"$or": [{"email": data.get("email")}, {"username": data.get("username")}]}):
         return jsonify({"error": "Username or email already exists."}), 400
     
     emp_id = generate_uuid("emp")
@@ -31,52 +35,112 @@ def add_employee():
         "corporate_level": data["access_level"],
         "department": data["department"]
     }
-    employees.insert_one(employee)
+    await get_employees().insert_one(employee)
     return jsonify({"message": "Successfully added employee", "id": emp_id})
 
 @main_bp.route('/add_document', methods=['POST'])
-def add_document():
-    data = request.json
-    doc_id = generate_uuid("data")
-    doc_text = data.get("text")
-    if not doc_text:
-        return jsonify({"error": "No document text received."}), 400
-    document = {
-        "_id": doc_id,
-        "text": doc_text,
-        "department": data.get("department", "unknown"),
-        "source": data.get("source", "unknown"),
-        "created_at": get_timestamp(),
-        "employees": data.get("employees"),
-        "access_level": data.get("access_level"),
-        "company_name": data.get("company_name", "unknown")
-    }
-    documents.insert_one(document)
-    embedding = embedd_text(doc_text)
-    chroma_collection.add(
-        ids=[doc_id],
-        documents=[doc_text],
-        metadatas=[{
-            "doc_id": doc_id,
-            "access_level": data.get("access_level"),
-            "department": data.get("department", "unknown")
-        }],
-        embeddings=[embedding]
-    )
-    return jsonify({"message": "Document added", "id": doc_id})
+async def add_document():
+    data = await request.get_json()
+    result = (await ingest_batch([(0, data)]))[0]
+    if "error" in result:
+        return jsonify({"error": result["error"]}), 500 if result.get("retryable") else 400
+    return jsonify({"message": "Document added", "id": result["id"], "status": result["status"]})
+
+@main_bp.route('/add_documents', methods=['POST'])
+async def add_documents():
+    # accepts a JSON array of documents or an NDJSON stream, one document per line.
+    # with ?dry_run=true nothing is written, the response only reports what would change
+    dry_run = request.args.get("dry_run", "").lower() in ("1", "true", "yes")
+    if request.mimetype == "application/x-ndjson":
+        results = await ingest_records(iter_ndjson(request.body), dry_run)
+    else:
+        records = await request.get_json()
+        if not isinstance(records, list):
+            return jsonify({"error": "Expected a JSON array of documents."}), 400
+        results = await ingest_records(records, dry_run)
+
+    summary = summarize_results(results)
+    # records that failed on our side make the request fail, so callers send them again
+    retryable = any(result.get("retryable") for result in results)
+    return jsonify({
+        "message": "Dry run, nothing was written" if dry_run else "Documents processed",
+        "added": summary["new"] + summary["changed"],
+        **summary,
+        "results": results
+    }), 500 if retryable else 200
+
+async def get_caller_filter(body):
+    # retrieval is limited to what the calling employee may see. The id is
+    # not authenticated, so until auth exists this only scopes results for
+    # honest clients. Requests without one get ANONYMOUS_ACCESS_LEVEL
+    employee_id = body.get("employee_id")
+    if not employee_id:
+        return anonymous_filter(), None
+    employee = await get_employee(employee_id)
+    if employee is None:
+        return None, (jsonify({"error": "Unknown employee."}), 403)
+    return access_filter(employee), None
+
+def cache_scope(where):
+    return json.dumps(where, sort_keys=True) if where else None
 
 @main_bp.route('/neurocorp', methods=['POST'])
-def corporate_brain():
-    body = request.json
+async def corporate_brain():
+    body = await request.get_json()
     prompts = body["messages"]
-    # user_access_level = request.json.get("access_level", 5)
+    where, error = await get_caller_filter(body)
+    if error:
+        return error
     
+    # read before retrieval, an answer built while documents arrive belongs to the older version
+    version = await get_knowledge_base_version()
+    query_embedding = await aembedd_text(combine_user_prompts(prompts))
+    cached_res = response_cache.get(query_embedding, cache_scope(where), version)
+    if cached_res is not None:
+        return jsonify(cached_res)
     
-    knowledge_base = retrieve_from_db(prompts)
+    knowledge_base = await retrieve_from_db(prompts, where)
 
-    agents_res = run_orchestration(prompts, knowledge_base)
+    agents_res = await run_orchestration(prompts, knowledge_base)
 
     if not agents_res:
         return jsonify({"error": "no information generated"})
+    if isinstance(agents_res, dict):
+        response_cache.set(query_embedding, agents_res, cache_scope(where), version)
     return jsonify(agents_res)
+
+@main_bp.route('/neurocorp/stream', methods=['POST'])
+async def corporate_brain_stream():
+    # same pipeline as /neurocorp, sent as NDJSON events while it runs
+    body = await request.get_json()
+    prompts = body["messages"]
+    where, error = await get_caller_filter(body)
+    if error:
+        return error
+
+    async def events():
+        version = await get_knowledge_base_version()
+        query_embedding = await aembedd_text(combine_user_prompts(prompts))
+        cached_res = response_cache.get(query_embedding, cache_scope(where), version)
+        if cached_res is not None:
+            yield to_ndjson({"event": "done", "result": cached_res})
+            return
+
+        yield to_ndjson({"event": "node_started", "node": "retrieval"})
+        knowledge_base = await retrieve_from_db(prompts, where)
+        yield to_ndjson({"event": "node_finished", "node": "retrieval"})
+
+        async for event in stream_orchestration(prompts, knowledge_base):
+            if event["event"] == "done":
+                response_cache.set(query_embedding, event["result"], cache_scope(where), version)
+            yield to_ndjson(event)
+
+    return events(), 200, {"Content-Type": "application/x-ndjson"}
+
+def to_ndjson(event):
+    return (json.dumps(event, default=str) + "\n").encode()
+
+@main_bp.route('/cache_stats', methods=['GET'])
+async def cache_stats():
+    return jsonify(response_cache.stats())
     
@@ -1,164 +1,104 @@
-<<<<<<< Updated upstream
 import uuid
+import heapq
+import asyncio
 import numpy as np
 from datetime import datetime
-from sentence_transformers import SentenceTransformer
-from .config import EMBEDDER_MODEL
+from .config import EMBEDDER_MODEL, EMBEDDER_BACKEND, EMBED_BATCH_SIZE, EMBEDDING_SOCKET, LEXICAL_WEIGHT
+from .config import CHROMA_COLLECTION, RETRIEVAL_MIN_SIMILARITY, RETRIEVAL_THRESHOLDS, RETRIEVAL_EXACT_RESCORE
 from langchain_core.output_parsers import StrOutputParser
-from langchain.prompts import ChatPromptTemplate
-from langchain_google_genai import ChatGoogleGenerativeAI
+from langchain_core.prompts import ChatPromptTemplate
 from typing import List
-from .db import chroma_collection, documents
-import json
+from .db import get_chroma_collection, get_documents
+from .lazy import lazy
+from .embedder import EmbeddingService, RemoteEmbeddingService, load_encoder, with_embedding_cache
+from .cache import query_expansion_cache
+from .lexical import get_lexical_index
+from .context import build_context
 from dotenv import load_dotenv
-import pickle
 
 load_dotenv() # to load gemini API key
 
-model = SentenceTransformer(EMBEDDER_MODEL)
-query_builder = ChatGoogleGenerativeAI(model="gemini-2.0-flash", temperature=0.2)
-
-def generate_uuid(prefix):
-    return f"{prefix}_{uuid.uuid4().hex[:8]}"
-
-def get_timestamp():
-    return datetime.now()
-
-def embedd_text(text):
-    if not text or not isinstance(text, str):
-        return
-    try:
-        embeddings = model.encode(text)
-        return embeddings
-    except:
-        return
-
-def get_different_prompts(chat_history: List[List[str]]):
-    if not chat_history or not len(chat_history) > 0:
-        return
-    
-    user_prompts = [prompt[1] for prompt in chat_history if prompt[0] == "user"]
-    if not user_prompts or not len(user_prompts) > 0:
-        return
-    
-    combined_query = " | ".join(user_prompts)
-
-    template = """You are a helpful assistant that generates multiple search queries based on a user input prompts history for a task. \n
+# heavy clients are built on first use so that importing the app stays fast
+@lazy
+def get_model():
+    return load_encoder(EMBEDDER_BACKEND, EMBEDDER_MODEL)
+
+@lazy
+def get_embedding_service():
+    # several workers can share one model (and its cache) through the embedding server
+    if EMBEDDING_SOCKET:
+        return RemoteEmbeddingService(EMBEDDING_SOCKET)
+    return with_embedding_cache(EmbeddingService(encode_batch))
+
+def warm_up_embeddings():
+    """ Loads the model this worker encodes with, or connects to the shared
+        embedding server without loading one """
+    if not EMBEDDING_SOCKET:
+        get_model()
+    get_embedding_service().submit(["warm up"]).result()
+
+@lazy
+def get_query_builder():
+    from langchain_google_genai import ChatGoogleGenerativeAI
+    return ChatGoogleGenerativeAI(model="gemini-2.0-flash", temperature=0.2)
+
+rag_fusion_template = """You are a helpful assistant that generates multiple search queries based on a user input prompts history for a task. \n
     Generate multiple search queries related to the user prompts, only include in your response the 4 queries, : {query} \n
     Output (4 queries):"""
-    prompt_rag_fusion = ChatPromptTemplate.from_template(template)
-    
-    generate_queries = (
+prompt_rag_fusion = ChatPromptTemplate.from_template(rag_fusion_template)
+
+@lazy
+def get_query_generator():
+    return (
         prompt_rag_fusion 
-        | query_builder
+        | get_query_builder()
         | StrOutputParser()
         | (lambda x: x.split("\n"))
     )
-    query_list = generate_queries.invoke({"query": combined_query})
-
-    return query_list
 
-def get_relevant_documents_ids(prompt_embeddings, max_num_of_docs, minimum_score = 0.65) -> List[str]:
-    results = chroma_collection.query(
-        query_embeddings=[prompt_embeddings],  # your_embedding is a list of floats
-        n_results=max_num_of_docs
-    )
-    ids = results.get("ids", [[]])[0]
-    scores = results.get("distances", [[]])[0]
-    relevant_ids = [doc_id for doc_id, score in zip(ids, scores) if score > minimum_score]
-    return relevant_ids
-
-def reciprocal_rank_fusion(results: list[list], k=60):
-    """ Reciprocal_rank_fusion that takes multiple lists of ranked documents 
-        and an optional parameter k used in the RRF formula """
-    
-    fused_scores = {}
-
-    for docs in results:
-        for rank, doc in enumerate(docs):
-            _ = doc.pop("created_at")
-            doc_bytes = json.dumps(doc) # Keep as bytes
-            if doc_bytes not in fused_scores:
-                fused_scores[doc_bytes] = 0
-            fused_scores[doc_bytes] += 1 / (rank + k)
-
-    reranked_results = [
-        json.loads(doc_bytes)
-        for doc_bytes, _ in sorted(fused_scores.items(), key=lambda x: x[1], reverse=True)
-    ]
+def generate_uuid(prefix):
+    return f"{prefix}_{uuid.uuid4().hex[:8]}"
 
-    return reranked_results
+def get_timestamp():
+    return datetime.now()
 
+def encode_batch(texts: List[str]):
+    return get_model().encode(texts, batch_size=EMBED_BATCH_SIZE, convert_to_numpy=True)
 
-def get_documents_per_prompt(prompt, max_num_of_docs: int = 10):
-    prompt_embeddings = embedd_text(prompt)
-    if not len(list(prompt_embeddings)) > 0:
+def embedd_text(text):
+    embeddings = embedd_texts([text])
+    if embeddings is None:
         return
-    
-    data_ids = get_relevant_documents_ids(prompt_embeddings, max_num_of_docs)
-
-    fetched_documents = list(documents.find({"_id": {"$in": data_ids}}))
-
-    return fetched_documents or []
+    return embeddings[0]
 
-def get_all_relevant_documents(prompt_list: List[str], max_num_of_all_docs: int = 20) -> List:
-    all_documents = []
-    for prompt in prompt_list:
-        all_documents.append(get_documents_per_prompt(prompt))
-    
-    all_documents_reranked = reciprocal_rank_fusion(all_documents)
-
-    return all_documents_reranked[:max_num_of_all_docs]
-
-def retrieve_from_db(chat_history: List[List[str]]):
-
-    preprocessed_prompts = get_different_prompts(chat_history)
-    if not preprocessed_prompts:
+def embedd_texts(texts: List[str]):
+    # one row per text, encoded by the embedding service together with
+    # whatever other requests are waiting
+    if not texts or not all(text and isinstance(text, str) for text in texts):
         return
-
-    relevant_documents = get_all_relevant_documents(preprocessed_prompts)
-
     try:
-        stringified_documents = json.dumps(relevant_documents)
-        return stringified_documents
-    except Exception as e:
-=======
-import uuid
-import numpy as np
-from datetime import datetime
-from sentence_transformers import SentenceTransformer
-from .config import EMBEDDER_MODEL
-from langchain_core.output_parsers import StrOutputParser
-from langchain.prompts import ChatPromptTemplate
-from langchain_google_genai import ChatGoogleGenerativeAI
-from typing import List
-from .db import chroma_collection, documents
-from langchain.load import dumps, loads
-import json
-from dotenv import load_dotenv
-import pickle
-
-load_dotenv() # to load gemini API key
-
-model = SentenceTransformer(EMBEDDER_MODEL)
-query_builder = ChatGoogleGenerativeAI(model="gemini-2.0-flash", temperature=0.2)
-
-def generate_uuid(prefix):
-    return f"{prefix}_{uuid.uuid4().hex[:8]}"
+        embeddings = get_embedding_service().submit(texts).result()
+        return embeddings
+    except:
+        return
 
-def get_timestamp():
-    return datetime.now()
+async def aembedd_text(text):
+    embeddings = await aembedd_texts([text])
+    if embeddings is None:
+        return
+    return embeddings[0]
 
-def embedd_text(text):
-    if not text or not isinstance(text, str):
+async def aembedd_texts(texts: List[str]):
+    if not texts or not all(text and isinstance(text, str) for text in texts):
         return
     try:
-        embeddings = model.encode(text)
+        # encoding is CPU bound, it runs on the service thread and not on the event loop
+        embeddings = await asyncio.wrap_future(get_embedding_service().submit(texts))
         return embeddings
     except:
         return
 
-def get_different_prompts(chat_history: List[List[str]]):
+def combine_user_prompts(chat_history: List[List[str]]):
     if not chat_history or not len(chat_history) > 0:
         return
     
@@ -166,86 +106,167 @@ def get_different_prompts(chat_history: List[List[str]]):
     if not user_prompts or not len(user_prompts) > 0:
         return
     
-    combined_query = " | ".join(user_prompts)
+    return " | ".join(user_prompts)
 
-    template = """You are a helpful assistant that generates multiple search queries based on a user input prompts history for a task. \n
-    Generate multiple search queries related to the user prompts, only include in your response the 4 queries, : {query} \n
-    Output (4 queries):"""
-    prompt_rag_fusion = ChatPromptTemplate.from_template(template)
-    
-    generate_queries = (
-        prompt_rag_fusion 
-        | query_builder
-        | StrOutputParser()
-        | (lambda x: x.split("\n"))
-    )
-    query_list = generate_queries.invoke({"query": combined_query})
+async def get_different_prompts(chat_history: List[List[str]]):
+    combined_query = combine_user_prompts(chat_history)
+    if not combined_query:
+        return
+
+    query_list = query_expansion_cache.get(combined_query)
+    if query_list is not None:
+        return query_list
+
+    query_list = await get_query_generator().ainvoke({"query": combined_query})
+    query_expansion_cache.set(combined_query, query_list)
 
     return query_list
 
-def get_relevant_documents_ids(prompt_embeddings, max_num_of_docs, minimum_score = 0.65) -> List[str]:
-    results = chroma_collection.query(
-        query_embeddings=[prompt_embeddings],  # your_embedding is a list of floats
-        n_results=max_num_of_docs
+def get_similarity_threshold(collection_name: str = CHROMA_COLLECTION) -> float:
+    return float(RETRIEVAL_THRESHOLDS.get(collection_name, RETRIEVAL_MIN_SIMILARITY))
+
+def rescore_exact(prompts_embeddings, texts_per_prompt, similarities_per_prompt):
+    """ Replaces the index similarities with exact dot products against the
+        chunk vectors in the embedding cache, hits the cache doesn't have
+        keep the index score """
+    cache = getattr(get_embedding_service(), "cache", None)
+    if cache is None:
+        return similarities_per_prompt
+    unique_texts = list(dict.fromkeys(text for texts in texts_per_prompt for text in texts))
+    cached = dict(zip(unique_texts, cache.get_many(unique_texts)))
+
+    queries = np.asarray(prompts_embeddings, dtype=np.float32)
+    queries = queries / np.maximum(np.linalg.norm(queries, axis=1, keepdims=True), 1e-12)
+    rescored = []
+    for query, texts, similarities in zip(queries, texts_per_prompt, similarities_per_prompt):
+        found = [i for i, text in enumerate(texts) if cached[text] is not None]
+        similarities = similarities.copy()
+        if found:
+            vectors = np.stack([cached[texts[i]] for i in found])
+            vectors /= np.maximum(np.linalg.norm(vectors, axis=1, keepdims=True), 1e-12)
+            similarities[found] = vectors @ query
+        rescored.append(similarities)
+    return rescored
+
+async def get_relevant_documents_ids(prompts_embeddings, max_num_of_docs, minimum_score: float = None, where: dict = None):
+    """ Runs a single query call for all the prompts and collapses the chunk
+        hits onto their parent documents. Returns one ranked list of
+        (parent id, cosine similarity of its best chunk) per prompt and the
+        matching chunk texts of every parent. `where` is applied inside the
+        index, before the top-k is taken, and hits below `minimum_score`
+        (the collection's threshold by default) are dropped """
+    if minimum_score is None:
+        minimum_score = get_similarity_threshold()
+    chroma_collection = await get_chroma_collection()
+    results = await chroma_collection.query(
+        query_embeddings=prompts_embeddings,
+        n_results=max_num_of_docs * 3,  # several chunks can belong to the same document
+        where=where,
+        include=["metadatas", "documents", "distances"]
     )
-    ids = results.get("ids", [[]])[0]
-    scores = results.get("distances", [[]])[0]
-    print(ids, scores)
-    relevant_ids = [doc_id for doc_id, score in zip(ids, scores) if score > minimum_score]
-    return relevant_ids
-
-def reciprocal_rank_fusion(results: list[list], k=60):
-    """ Reciprocal_rank_fusion that takes multiple lists of ranked documents 
-        and an optional parameter k used in the RRF formula """
-    
+    metadatas_per_prompt = results.get("metadatas") or []
+    texts_per_prompt = results.get("documents") or []
+    # the collection uses cosine distance, 1 - distance is the cosine similarity
+    similarities_per_prompt = [
+        1 - np.asarray(distances, dtype=np.float32) for distances in results.get("distances") or []
+    ]
+    if RETRIEVAL_EXACT_RESCORE:
+        similarities_per_prompt = await asyncio.to_thread(
+            rescore_exact, prompts_embeddings, texts_per_prompt, similarities_per_prompt
+        )
+
+    relevant_ids = []
+    matched_chunks = {}
+    for metadatas, texts, similarities in zip(metadatas_per_prompt, texts_per_prompt, similarities_per_prompt):
+        order = np.argsort(-similarities, kind="stable")
+        ranked = {}
+        for i in order[similarities[order] >= minimum_score]:
+            doc_id = metadatas[i]["doc_id"]
+            if doc_id not in ranked:
+                if len(ranked) == max_num_of_docs:
+                    continue
+                ranked[doc_id] = float(similarities[i])
+            chunks = matched_chunks.setdefault(doc_id, [])
+            if texts[i] not in chunks:
+                chunks.append(texts[i])
+        relevant_ids.append(list(ranked.items()))
+    return relevant_ids, matched_chunks
+
+def reciprocal_rank_fusion(results: list[list], k=60, weights: list[float] = None, top_n: int = None):
+    """ Reciprocal_rank_fusion that takes multiple lists of ranked documents,
+        optional per-list weights and an optional cutoff on the number of
+        documents returned. Documents are matched on their `_id` and returned
+        as the same objects that were passed in """
+    if weights is None:
+        weights = [1] * len(results)
+
     fused_scores = {}
+    fused_documents = {}
 
-    for docs in results:
+    for docs, weight in zip(results, weights):
         for rank, doc in enumerate(docs):
-            doc_bytes = pickle.dumps(doc)  # Keep as bytes
-            if doc_bytes not in fused_scores:
-                fused_scores[doc_bytes] = 0
-            fused_scores[doc_bytes] += 1 / (rank + k)
-
-    reranked_results = [
-        pickle.loads(doc_bytes)
-        for doc_bytes, _ in sorted(fused_scores.items(), key=lambda x: x[1], reverse=True)
+            doc_id = doc["_id"]
+            fused_scores[doc_id] = fused_scores.get(doc_id, 0) + weight / (rank + k)
+            fused_documents.setdefault(doc_id, doc)
+
+    if top_n is None:
+        ranked_ids = sorted(fused_scores, key=fused_scores.get, reverse=True)
+    else:
+        ranked_ids = heapq.nlargest(top_n, fused_scores, key=fused_scores.get)
+
+    return [fused_documents[doc_id] for doc_id in ranked_ids]
+
+
+async def get_documents_by_ids(data_ids: List[str]) -> dict:
+    if not data_ids:
+        return {}
+    fetched_documents = await get_documents().find({"_id": {"$in": data_ids}}).to_list(length=None)
+    return {document["_id"]: document for document in fetched_documents}
+
+async def get_all_relevant_documents(prompt_list: List[str], max_num_of_all_docs: int = 20, max_num_of_docs: int = 10, where: dict = None) -> List:
+    prompt_list = [prompt.strip() for prompt in prompt_list if prompt and prompt.strip()]
+    prompts_embeddings = await aembedd_texts(prompt_list)
+    if prompts_embeddings is None or not len(prompts_embeddings) > 0:
+        return []
+
+    vector_hits, matched_chunks = await get_relevant_documents_ids(prompts_embeddings, max_num_of_docs, where=where)
+    ranked_ids = [[doc_id for doc_id, _ in hits] for hits in vector_hits]
+    scores = {}
+    for hits in vector_hits:
+        for doc_id, score in hits:
+            scores[doc_id] = max(score, scores.get(doc_id, score))
+    weights = [1] * len(ranked_ids)
+    if LEXICAL_WEIGHT:
+        # exact names and ids the embeddings miss, one BM25 list per prompt
+        lexical_index = await get_lexical_index()
+        lexical_ids = await asyncio.gather(*(
+            asyncio.to_thread(lexical_index.search, prompt, max_num_of_docs, where) for prompt in prompt_list
+        ))
+        ranked_ids = ranked_ids + list(lexical_ids)
+        weights += [LEXICAL_WEIGHT] * len(lexical_ids)
+
+    # hydrate the union of all the hits with one lookup
+    unique_ids = list(dict.fromkeys(doc_id for ids in ranked_ids for doc_id in ids))
+    documents_by_id = await get_documents_by_ids(unique_ids)
+
+    all_documents = [
+        [documents_by_id[doc_id] for doc_id in ids if doc_id in documents_by_id]
+        for ids in ranked_ids
     ]
 
-    return reranked_results
-
-
-def get_documents_per_prompt(prompt, max_num_of_docs: int = 10):
-    prompt_embeddings = embedd_text(prompt)
-    if not len(list(prompt_embeddings)) > 0:
-        return
-    
-    data_ids = get_relevant_documents_ids(prompt_embeddings, max_num_of_docs)
-
-    fetched_documents = list(documents.find({"_id": {"$in": data_ids}}))
+    relevant_documents = reciprocal_rank_fusion(all_documents, weights=weights, top_n=max_num_of_all_docs)
+    for document in relevant_documents:
+        document["chunks"] = matched_chunks.get(document["_id"], [])
+        # None for documents only the lexical index found
+        document["score"] = scores.get(document["_id"])
+    return relevant_documents
 
-    return fetched_documents or []
+async def retrieve_from_db(chat_history: List[List[str]], where: dict = None):
 
-def get_all_relevant_documents(prompt_list: List[str], max_num_of_all_docs: int = 20) -> List:
-    all_documents = []
-    for prompt in prompt_list:
-        all_documents.append(get_documents_per_prompt(prompt))
-    
-    all_documents_reranked = reciprocal_rank_fusion(all_documents)
-    
-    return all_documents_reranked[:max_num_of_all_docs]
-
-def retrieve_from_db(chat_history: List[List[str]]):
-
-    preprocessed_prompts = get_different_prompts(chat_history)
+    preprocessed_prompts = await get_different_prompts(chat_history)
     if not preprocessed_prompts:
         return
 
-    relevant_documents = get_all_relevant_documents(preprocessed_prompts)
+    relevant_documents = await get_all_relevant_documents(preprocessed_prompts, where=where)
 
-    try:
-        stringified_documents = pickle.dumps(relevant_documents)
-        return stringified_documents
-    except Exception as e:
->>>>>>> Stashed changes
-        return
\ No newline at end of file
+    return build_context(relevant_documents)
@@ -0,0 +1,317 @@
+import os
+import json
+import fcntl
+import shutil
+import sqlite3
+import asyncio
+import threading
+import numpy as np
+
+
+def where_mask(where: dict, column) -> np.ndarray:
+    """ Evaluates a Chroma `where` clause ($and, $or, $eq, $ne, $in, $nin,
+        $gt, $gte, $lt, $lte and plain equality) into a boolean mask.
+        `column(field)` returns the values of a metadata field, one per row """
+    if "$and" in where:
+        masks = [where_mask(condition, column) for condition in where["$and"]]
+        return np.logical_and.reduce(masks)
+    if "$or" in where:
+        masks = [where_mask(condition, column) for condition in where["$or"]]
+        return np.logical_or.reduce(masks)
+
+    mask = None
+    for field, condition in where.items():
+        values = column(field)
+        if not isinstance(condition, dict):
+            condition = {"$eq": condition}
+        for operator, operand in condition.items():
+            if operator == "$eq":
+                matched = values == operand
+            elif operator == "$ne":
+                matched = values != operand
+            elif operator in ("$in", "$nin"):
+                allowed = set(operand)
+                matched = np.fromiter((value in allowed for value in values), dtype=bool, count=len(values))
+                if operator == "$nin":
+                    matched = ~matched
+            elif operator in ("$gt", "$gte", "$lt", "$lte"):
+                compare = {"$gt": np.greater, "$gte": np.greater_equal, "$lt": np.less, "$lte": np.less_equal}[operator]
+                matched = np.fromiter(
+                    (value is not None and compare(value, operand) for value in values), dtype=bool, count=len(values)
+                )
+            else:
+                raise ValueError(f"Unsupported where operator {operator}")
+            matched = np.asarray(matched, dtype=bool)
+            mask = matched if mask is None else mask & matched
+    return mask
+
+
+LOCK_FILE = "store.lock"
+
+
+def lock_store(path):
+    """ Takes an exclusive lock on the store directory for as long as the
+        returned file stays open. The embedded stores keep their state in
+        the process that opened them, a second process (another hypercorn
+        worker) would hand out the same rows and never see the other's writes """
+    os.makedirs(path, exist_ok=True)
+    lock_file = open(os.path.join(path, LOCK_FILE), "a")
+    try:
+        fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except BlockingIOError:
+        lock_file.close()
+        raise RuntimeError(
+            f"The vector store in {path} is already open in another process. The embedded stores "
+            "only support a single process, run one worker or use VECTOR_STORE=http"
+        ) from None
+    return lock_file
+
+
+class NumpyCollection:
+    """ Embedded vector store with Chroma's collection API: a memory-mapped
+        float32 matrix of unit vectors searched exactly with one matrix
+        product, and a SQLite file holding the ids, documents and metadata.
+        Deleted rows are reused by later inserts. Only one process can open
+        a store, see lock_store """
+
+    VECTORS_FILE = "vectors.f32"
+    ROWS_FILE = "rows.sqlite3"
+    MIN_CAPACITY = 1024
+
+    def __init__(self, path):
+        self.path = path
+        self._lock_file = lock_store(path)
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(os.path.join(path, self.ROWS_FILE), check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("CREATE TABLE IF NOT EXISTS settings (key TEXT PRIMARY KEY, value TEXT NOT NULL)")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS rows (row INTEGER PRIMARY KEY, id TEXT UNIQUE NOT NULL, document TEXT, metadata TEXT)"
+        )
+        self._db.commit()
+
+        settings = dict(self._db.execute("SELECT key, value FROM settings"))
+        self.dimension = int(settings["dimension"]) if "dimension" in settings else None
+        self._vectors = None
+        self._ids = []  # row -> id, None for a free row
+        self._rows = {}  # id -> row
+        self._documents = []
+        self._metadatas = []
+        self._live = np.zeros(0, dtype=bool)
+        self._columns = {}  # metadata field -> values of every row, rebuilt after writes
+        self._masks = {}  # where clause -> matching rows, rebuilt after writes
+        for row, doc_id, document, metadata in self._db.execute("SELECT row, id, document, metadata FROM rows"):
+            self._ensure_rows(row + 1)
+            self._ids[row] = doc_id
+            self._rows[doc_id] = row
+            self._live[row] = True
+            self._documents[row] = document
+            self._metadatas[row] = json.loads(metadata) if metadata else None
+        if self.dimension is not None:
+            self._open_vectors(max(len(self._ids), self.MIN_CAPACITY))
+
+    def _ensure_rows(self, count):
+        missing = count - len(self._ids)
+        if missing > 0:
+            self._ids.extend([None] * missing)
+            self._documents.extend([None] * missing)
+            self._metadatas.extend([None] * missing)
+        if count > len(self._live):
+            self._live = np.concatenate([self._live, np.zeros(max(count - len(self._live), len(self._live)), dtype=bool)])
+
+    def _open_vectors(self, capacity):
+        vectors_file = os.path.join(self.path, self.VECTORS_FILE)
+        size = capacity * self.dimension * 4
+        if self._vectors is not None:
+            self._vectors.flush()
+            self._vectors = None
+        if not os.path.exists(vectors_file) or os.path.getsize(vectors_file) < size:
+            with open(vectors_file, "ab") as f:
+                f.truncate(size)
+        rows = os.path.getsize(vectors_file) // (self.dimension * 4)
+        self._vectors = np.memmap(vectors_file, dtype=np.float32, mode="r+", shape=(rows, self.dimension))
+
+    async def count(self):
+        return len(self._rows)
+
+    async def add(self, ids, embeddings, metadatas=None, documents=None):
+        """ Like upsert, but ids that already exist are left untouched """
+        await asyncio.to_thread(self._write, ids, embeddings, metadatas, documents, False)
+
+    async def upsert(self, ids, embeddings, metadatas=None, documents=None):
+        await asyncio.to_thread(self._write, ids, embeddings, metadatas, documents, True)
+
+    async def delete(self, ids=None, where=None):
+        await asyncio.to_thread(self._delete, ids, where)
+
+    async def query(self, query_embeddings, n_results=10, where=None, include=("metadatas", "documents", "distances")):
+        return await asyncio.to_thread(self._query, query_embeddings, n_results, where, include)
+
+    async def snapshot(self, target):
+        """ Copies a consistent state of the store to the directory `target` """
+        await asyncio.to_thread(self._snapshot, target)
+
+    def _write(self, ids, embeddings, metadatas, documents, replace):
+        embeddings = np.asarray(embeddings, dtype=np.float32)
+        if embeddings.ndim != 2 or len(embeddings) != len(ids):
+            raise ValueError("Expected one embedding per id")
+        norms = np.linalg.norm(embeddings, axis=1, keepdims=True)
+        embeddings = embeddings / np.where(norms == 0, 1, norms)
+        metadatas = metadatas or [None] * len(ids)
+        documents = documents or [None] * len(ids)
+
+        with self._lock:
+            if self.dimension is None:
+                self.dimension = embeddings.shape[1]
+                self._db.execute("INSERT INTO settings (key, value) VALUES ('dimension', ?)", (str(self.dimension),))
+                self._open_vectors(self.MIN_CAPACITY)
+            elif embeddings.shape[1] != self.dimension:
+                raise ValueError(f"Expected embeddings of dimension {self.dimension}, got {embeddings.shape[1]}")
+
+            free_rows = iter(np.flatnonzero(~self._live[:len(self._ids)]).tolist())
+            records = []
+            for doc_id, embedding, metadata, document in zip(ids, embeddings, metadatas, documents):
+                row = self._rows.get(doc_id)
+                if row is not None and not replace:
+                    continue
+                if row is None:
+                    row = next(free_rows, None)
+                    if row is None:
+                        row = len(self._ids)
+                        self._ensure_rows(row + 1)
+                    self._ids[row] = doc_id
+                    self._rows[doc_id] = row
+                    self._live[row] = True
+                if row >= len(self._vectors):
+                    self._open_vectors(max(2 * len(self._vectors), row + 1))
+                self._vectors[row] = embedding
+                self._metadatas[row] = metadata
+                self._documents[row] = document
+                records.append((row, doc_id, document, json.dumps(metadata) if metadata is not None else None))
+            self._vectors.flush()
+            self._db.executemany(
+                "INSERT OR REPLACE INTO rows (row, id, document, metadata) VALUES (?, ?, ?, ?)", records
+            )
+            self._db.commit()
+            self._columns = {}
+            self._masks = {}
+
+    def _delete(self, ids, where):
+        with self._lock:
+            rows = set()
+            if ids is not None:
+                rows.update(self._rows[doc_id] for doc_id in ids if doc_id in self._rows)
+            if where:
+                rows.update(np.flatnonzero(self._where_rows(where)).tolist())
+            for row in rows:
+                del self._rows[self._ids[row]]
+                self._ids[row] = None
+                self._live[row] = False
+                self._metadatas[row] = None
+                self._documents[row] = None
+            self._db.executemany("DELETE FROM rows WHERE row = ?", [(row,) for row in rows])
+            self._db.commit()
+            self._columns = {}
+            self._masks = {}
+
+    def _query(self, query_embeddings, n_results, where, include):
+        queries = np.atleast_2d(np.asarray(query_embeddings, dtype=np.float32))
+        norms = np.linalg.norm(queries, axis=1, keepdims=True)
+        queries = queries / np.where(norms == 0, 1, norms)
+
+        with self._lock:
+            candidates = np.flatnonzero(self._where_rows(where) if where else self._live[:len(self._ids)])
+            results = {"ids": [], "metadatas": [], "documents": [], "distances": []}
+            if not len(candidates):
+                similarities = np.empty((len(queries), 0), dtype=np.float32)
+            elif len(candidates) * 4 > len(self._ids):
+                # scoring every row beats gathering a large subset of the matrix
+                similarities = (queries @ self._vectors[:len(self._ids)].T)[:, candidates]
+            else:
+                similarities = queries @ self._vectors[candidates].T
+
+            top_n = min(n_results, len(candidates))
+            for row_similarities in similarities:
+                if top_n < len(candidates):
+                    best = np.argpartition(-row_similarities, top_n - 1)[:top_n]
+                else:
+                    best = np.arange(len(candidates))
+                best = best[np.argsort(-row_similarities[best], kind="stable")]
+                rows = candidates[best]
+                results["ids"].append([self._ids[row] for row in rows])
+                results["metadatas"].append([self._metadatas[row] for row in rows])
+                results["documents"].append([self._documents[row] for row in rows])
+                # cosine distance, like a Chroma collection with hnsw:space cosine
+                results["distances"].append((1 - row_similarities[best]).tolist())
+        return {key: value for key, value in results.items() if key == "ids" or key in include}
+
+    def _where_rows(self, where):
+        # the same access filter is asked for over and over, keep its rows until the next write
+        key = json.dumps(where, sort_keys=True)
+        if key not in self._masks:
+            self._masks[key] = self._live[:len(self._ids)] & where_mask(where, self._column)
+        return self._masks[key]
+
+    def _column(self, field):
+        if field not in self._columns:
+            values = np.empty(len(self._ids), dtype=object)
+            values[:] = [metadata.get(field) if metadata else None for metadata in self._metadatas]
+            self._columns[field] = values
+        return self._columns[field]
+
+    def _snapshot(self, target):
+        os.makedirs(target, exist_ok=True)
+        with self._lock:
+            if self._vectors is not None:
+                self._vectors.flush()
+                shutil.copyfile(os.path.join(self.path, self.VECTORS_FILE), os.path.join(target, self.VECTORS_FILE))
+            with sqlite3.connect(os.path.join(target, self.ROWS_FILE)) as destination:
+                self._db.backup(destination)
+
+
+class ThreadedCollection:
+    """ Async facade over a synchronous embedded Chroma collection
+        (PersistentClient), so callers use the same awaitable API as the
+        HTTP client. PersistentClient isn't process safe, `lock_file` holds
+        the store's lock for as long as the collection is open """
+
+    def __init__(self, client, collection, path, lock_file=None):
+        self.client = client
+        self.collection = collection
+        self.path = path
+        self._lock_file = lock_file
+        self._lock = threading.Lock()
+
+    async def count(self):
+        return await asyncio.to_thread(self.collection.count)
+
+    async def add(self, **kwargs):
+        await asyncio.to_thread(self._locked, self.collection.add, **kwargs)
+
+    async def upsert(self, **kwargs):
+        await asyncio.to_thread(self._locked, self.collection.upsert, **kwargs)
+
+    async def delete(self, **kwargs):
+        await asyncio.to_thread(self._locked, self.collection.delete, **kwargs)
+
+    async def query(self, **kwargs):
+        return await asyncio.to_thread(self.collection.query, **kwargs)
+
+    async def snapshot(self, target):
+        """ Copies the persist directory while writes are held back """
+        await asyncio.to_thread(
+            self._locked, shutil.copytree, self.path, target,
+            dirs_exist_ok=True, ignore=shutil.ignore_patterns(LOCK_FILE)
+        )
+
+    def _locked(self, method, *args, **kwargs):
+        with self._lock:
+            return method(*args, **kwargs)
+
+
+def open_persistent_collection(path, name):
+    import chromadb
+    lock_file = lock_store(path)
+    client = chromadb.PersistentClient(path=path)
+    collection = client.get_or_create_collection(name=name, metadata={"hnsw:space": "cosine"})
+    return ThreadedCollection(client, collection, path, lock_file)
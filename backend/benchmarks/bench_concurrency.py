@@ -0,0 +1,132 @@
+"""Load test for /neurocorp with mocked LLM and database backends.
+
+Every Gemini call, Chroma query and Mongo fetch is replaced with a stub
+that awaits a fixed latency, so the run measures how many chat sessions a
+single process can serve at once rather than backend speed.
+
+Run from the backend directory:
+    python -m benchmarks.bench_concurrency
+"""
+import os
+import time
+import asyncio
+
+import numpy as np
+from langchain_core.runnables import RunnableLambda
+
+os.environ.setdefault("GOOGLE_API_KEY", "benchmark")
+
+from app import create_app
+from app import utils
+from app import routes
+from app import orchestrator_agent as oa
+from app.lexical import LexicalIndex
+
+LLM_LATENCY = 0.3  # seconds per stubbed Gemini call
+DB_LATENCY = 0.02  # seconds per stubbed Chroma / Mongo round-trip
+CONCURRENT_SESSIONS = 50
+
+
+def stub_llm(output):
+    async def call(_inputs):
+        await asyncio.sleep(LLM_LATENCY)
+        return output
+    return RunnableLambda(call)
+
+
+class FakeCollection:
+    async def query(self, query_embeddings, n_results, **kwargs):
+        await asyncio.sleep(DB_LATENCY)
+        ids = [[f"data_{i}#0" for i in range(n_results)] for _ in query_embeddings]
+        metadatas = [[{"doc_id": f"data_{i}"} for i in range(n_results)] for _ in query_embeddings]
+        texts = [[f"chunk of data_{i}" for i in range(n_results)] for _ in query_embeddings]
+        distances = [[0.2] * n_results for _ in query_embeddings]
+        return {"ids": ids, "metadatas": metadatas, "documents": texts, "distances": distances}
+
+
+class FakeCursor:
+    def __init__(self, ids):
+        self.ids = ids
+
+    async def to_list(self, length=None):
+        await asyncio.sleep(DB_LATENCY)
+        return [{"_id": doc_id, "text": f"text of {doc_id}", "created_at": None} for doc_id in self.ids]
+
+
+class FakeDocuments:
+    def find(self, query, *args, **kwargs):
+        return FakeCursor(query["_id"]["$in"])
+
+
+async def fake_get_chroma_collection():
+    return FakeCollection()
+
+
+async def fake_aembedd_text(text):
+    return np.ones(384, dtype=np.float32)
+
+
+async def fake_get_knowledge_base_version():
+    return 0
+
+
+async def fake_aembedd_texts(texts):
+    return np.ones((len(texts), 384), dtype=np.float32)
+
+
+def install_stubs():
+    lexical_index = LexicalIndex()
+    lexical_index.add([{"_id": f"data_{i}", "text": f"ibis migration status update {i}"} for i in range(1000)])
+    lexical_index.loaded = True
+
+    async def fake_get_lexical_index():
+        return lexical_index
+
+    query_generator = stub_llm(["query one", "query two", "query three", "query four"])
+    utils.get_query_generator = lambda: query_generator
+    utils.query_expansion_cache.max_entries = 0
+    utils.get_chroma_collection = fake_get_chroma_collection
+    fake_documents = FakeDocuments()
+    utils.get_documents = lambda: fake_documents
+    utils.get_lexical_index = fake_get_lexical_index
+    utils.aembedd_texts = fake_aembedd_texts
+    routes.aembedd_text = fake_aembedd_text
+    routes.get_knowledge_base_version = fake_get_knowledge_base_version
+    # every session asks the same question, keep the response cache out of the way
+    routes.response_cache.max_entries = 0
+    technical, business, report = stub_llm("technical output"), stub_llm("business output"), stub_llm("report output")
+    oa.get_technical_analyst_chain = lambda: technical
+    oa.get_business_analyst_chain = lambda: business
+    oa.get_report_agent_chain = lambda: report
+
+
+async def run_load(client, sessions, concurrent):
+    body = {"messages": [["user", "What is the status of the ibis migration?"]]}
+
+    async def one_session():
+        response = await client.post("/neurocorp", json=body)
+        assert response.status_code == 200
+
+    start = time.perf_counter()
+    if concurrent:
+        await asyncio.gather(*(one_session() for _ in range(sessions)))
+    else:
+        for _ in range(sessions):
+            await one_session()
+    return time.perf_counter() - start
+
+
+async def main():
+    install_stubs()
+    client = create_app().test_client()
+
+    serial = await run_load(client, CONCURRENT_SESSIONS, concurrent=False)
+    concurrent = await run_load(client, CONCURRENT_SESSIONS, concurrent=True)
+
+    print(f"{CONCURRENT_SESSIONS} sessions, stub LLM {LLM_LATENCY:.2f}s, stub DB {DB_LATENCY:.3f}s")
+    print(f"one at a time: {serial:.2f}s ({CONCURRENT_SESSIONS / serial:.1f} req/s)")
+    print(f"concurrent:    {concurrent:.2f}s ({CONCURRENT_SESSIONS / concurrent:.1f} req/s)")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,70 @@
+"""Recall vs latency of the embedder backends on the stored documents.
+
+Samples documents from the Mongo `data` collection, embeds them with every
+backend and times the encoding. Queries are the first words of a subset of
+those documents. Recall@k is the overlap of each backend's top-k neighbours
+with the neighbours found by the current torch FP32 model.
+
+Needs MONGO_URI / MONGO_CLIENT, run from the backend directory:
+    python -m benchmarks.bench_embedder_backends
+"""
+import time
+
+import numpy as np
+from pymongo import MongoClient
+
+from app.config import MONGO_URI, MONGO_CLIENT, EMBEDDER_MODEL, EMBED_BATCH_SIZE
+from app.embedder import EMBEDDER_BACKENDS, load_encoder
+
+SAMPLE_SIZE = 2000
+NUM_QUERIES = 200
+QUERY_WORDS = 12
+TOP_K = 10
+
+
+def load_corpus():
+    documents = MongoClient(MONGO_URI)[MONGO_CLIENT]["data"]
+    sample = documents.aggregate([
+        {"$match": {"text": {"$type": "string", "$ne": ""}}},
+        {"$sample": {"size": SAMPLE_SIZE}},
+        {"$project": {"text": 1}}
+    ])
+    texts = [document["text"] for document in sample]
+    queries = [" ".join(text.split()[:QUERY_WORDS]) for text in texts[:NUM_QUERIES]]
+    return texts, queries
+
+
+def encode(model, texts):
+    return model.encode(texts, batch_size=EMBED_BATCH_SIZE, convert_to_numpy=True, normalize_embeddings=True)
+
+
+def top_k(corpus_embeddings, query_embeddings):
+    scores = query_embeddings @ corpus_embeddings.T
+    return np.argsort(-scores, axis=1)[:, :TOP_K]
+
+
+def main():
+    texts, queries = load_corpus()
+    if not texts:
+        print("No documents found in the data collection")
+        return
+
+    baseline = None
+    print(f"{EMBEDDER_MODEL}: {len(texts)} documents, {len(queries)} queries, recall@{TOP_K} vs torch")
+    for backend in EMBEDDER_BACKENDS:
+        model = load_encoder(backend, EMBEDDER_MODEL)
+        encode(model, texts[:EMBED_BATCH_SIZE])  # warm up
+
+        start = time.perf_counter()
+        corpus_embeddings = encode(model, texts)
+        elapsed = time.perf_counter() - start
+        neighbours = top_k(corpus_embeddings, encode(model, queries))
+
+        if baseline is None:
+            baseline = neighbours
+        recall = np.mean([len(set(a) & set(b)) / TOP_K for a, b in zip(neighbours, baseline)])
+        print(f"{backend:>10}: {len(texts) / elapsed:8.1f} docs/s  recall {recall:.3f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,48 @@
+"""Per-string vs batched encoding of the RAG-fusion queries.
+
+Loads the same SentenceTransformer as the app and encodes a typical set of
+four generated search queries, first one string at a time (the old
+retrieval path) and then as a single batch.
+
+Run from the backend directory:
+    python -m benchmarks.bench_embedding
+"""
+import time
+
+from sentence_transformers import SentenceTransformer
+
+from app.config import EMBEDDER_MODEL
+
+RUNS = 50
+QUERIES = [
+    "1. What is the current status of the SQLAlchemy to Ibis migration?",
+    "2. Which teams are blocked by the Ibis migration and why?",
+    "3. What technical risks were raised about replacing SQLAlchemy?",
+    "4. Timeline and owners for the remaining migration tasks",
+]
+
+
+def best_of(fn):
+    timings = []
+    for _ in range(RUNS):
+        start = time.perf_counter()
+        fn()
+        timings.append(time.perf_counter() - start)
+    return min(timings)
+
+
+def main():
+    model = SentenceTransformer(EMBEDDER_MODEL, device="cpu")
+    model.encode(QUERIES)  # warm up
+
+    per_string = best_of(lambda: [model.encode(query) for query in QUERIES])
+    batched = best_of(lambda: model.encode(QUERIES, convert_to_numpy=True))
+
+    print(f"{EMBEDDER_MODEL} on CPU, {len(QUERIES)} queries, best of {RUNS} runs")
+    print(f"per-string: {per_string * 1000:.2f}ms")
+    print(f"batched:    {batched * 1000:.2f}ms")
+    print(f"speed-up:   {per_string / batched:.2f}x")
+
+
+if __name__ == "__main__":
+    main()
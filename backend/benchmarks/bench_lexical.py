@@ -0,0 +1,115 @@
+"""Recall and latency of the BM25 index against vector-only retrieval.
+
+Samples documents from the Mongo `data` collection. Every sampled query
+has one relevant document, the one it was built from. There are two kinds:
+
+  keywords  the rarest terms of the document, the way people search for
+            a ticket id, a person or a channel name
+  prefix    the first words of the document
+
+Recall@k of vector search (the configured embedder, exact cosine top-k),
+BM25 and both fused with reciprocal_rank_fusion is printed per kind. The
+index is then grown with copies of the sample up to SCALE_DOCUMENTS to
+time BM25 queries at that size.
+
+Needs MONGO_URI / MONGO_CLIENT, run from the backend directory:
+    python -m benchmarks.bench_lexical
+"""
+import math
+import time
+import random
+from collections import Counter
+
+import numpy as np
+from pymongo import MongoClient
+
+from app.config import MONGO_URI, MONGO_CLIENT, EMBEDDER_MODEL, EMBEDDER_BACKEND, EMBED_BATCH_SIZE
+from app.embedder import load_encoder
+from app.lexical import LexicalIndex, tokenize
+from app.utils import reciprocal_rank_fusion
+
+SAMPLE_SIZE = 5000
+NUM_QUERIES = 300
+QUERY_WORDS = 12
+KEYWORDS = 3
+TOP_K = 10
+SCALE_DOCUMENTS = 300_000
+SCALE_QUERIES = 200
+
+
+def load_corpus():
+    documents = MongoClient(MONGO_URI)[MONGO_CLIENT]["data"]
+    sample = documents.aggregate([
+        {"$match": {"text": {"$type": "string", "$ne": ""}}},
+        {"$sample": {"size": SAMPLE_SIZE}},
+        {"$project": {"text": 1, "access_level": 1, "department": 1}}
+    ])
+    return list(sample)
+
+
+def build_queries(corpus):
+    document_frequency = Counter(term for document in corpus for term in set(tokenize(document["text"])))
+    queries = {"keywords": [], "prefix": []}
+    for position in random.Random(0).sample(range(len(corpus)), min(NUM_QUERIES, len(corpus))):
+        text = corpus[position]["text"]
+        terms = sorted(set(tokenize(text)), key=lambda term: document_frequency[term])
+        if len(terms) >= KEYWORDS:
+            queries["keywords"].append((" ".join(terms[:KEYWORDS]), position))
+        queries["prefix"].append((" ".join(text.split()[:QUERY_WORDS]), position))
+    return queries
+
+
+def recall(results, expected):
+    return np.mean([position in found[:TOP_K] for found, position in zip(results, expected)])
+
+
+def main():
+    corpus = load_corpus()
+    if not corpus:
+        print("No documents found in the data collection")
+        return
+    for position, document in enumerate(corpus):
+        document["_id"] = position
+
+    index = LexicalIndex()
+    start = time.perf_counter()
+    index.add(corpus)
+    print(f"indexed {len(corpus)} documents in {time.perf_counter() - start:.2f}s")
+
+    model = load_encoder(EMBEDDER_BACKEND, EMBEDDER_MODEL)
+    encode = lambda texts: model.encode(texts, batch_size=EMBED_BATCH_SIZE, convert_to_numpy=True, normalize_embeddings=True)
+    corpus_embeddings = encode([document["text"] for document in corpus])
+
+    print(f"{EMBEDDER_MODEL} ({EMBEDDER_BACKEND}), recall@{TOP_K}")
+    for kind, queries in build_queries(corpus).items():
+        texts = [text for text, _ in queries]
+        expected = [position for _, position in queries]
+
+        scores = encode(texts) @ corpus_embeddings.T
+        vector = [list(np.argsort(-row)[:TOP_K]) for row in scores]
+        lexical = [index.search(text, TOP_K) for text in texts]
+        hybrid = [
+            [document["_id"] for document in reciprocal_rank_fusion(
+                [[corpus[p] for p in vector_ids], [corpus[p] for p in lexical_ids]], top_n=TOP_K
+            )]
+            for vector_ids, lexical_ids in zip(vector, lexical)
+        ]
+        print(f"{kind:>9}: vector {recall(vector, expected):.3f}  bm25 {recall(lexical, expected):.3f}"
+              f"  hybrid {recall(hybrid, expected):.3f}  ({len(queries)} queries)")
+
+    # grow the index with renamed copies of the sample and time the queries
+    copies = math.ceil(SCALE_DOCUMENTS / len(corpus))
+    for copy in range(1, copies):
+        index.add([{**document, "_id": f"{copy}:{document['_id']}"} for document in corpus])
+    texts = [" ".join(random.Random(i).choice(corpus)["text"].split()[:QUERY_WORDS]) for i in range(SCALE_QUERIES)]
+    timings = []
+    for text in texts:
+        start = time.perf_counter()
+        index.search(text, TOP_K)
+        timings.append(time.perf_counter() - start)
+    timings = np.array(timings) * 1000
+    print(f"{len(index)} documents: p50 {np.percentile(timings, 50):.2f}ms  p95 {np.percentile(timings, 95):.2f}ms per query")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,78 @@
+"""Wall-clock comparison of the sequential and fan-out orchestrator graphs.
+
+The three LLM chains are replaced with stubs that sleep for a fixed latency,
+so the numbers only reflect how the graph schedules the nodes.
+
+Run from the backend directory:
+    python -m benchmarks.bench_orchestrator
+"""
+import os
+import time
+import asyncio
+
+from langchain_core.runnables import RunnableLambda
+from langgraph.graph import StateGraph, END
+
+os.environ.setdefault("GOOGLE_API_KEY", "benchmark")
+
+from app import orchestrator_agent as oa
+
+LLM_LATENCY = 0.5  # seconds per stubbed LLM call
+RUNS = 5
+
+
+def stub_chain(label):
+    async def call(_inputs):
+        await asyncio.sleep(LLM_LATENCY)
+        return f"{label} output"
+    return RunnableLambda(call)
+
+
+def build_sequential_graph():
+    workflow = StateGraph(oa.OrchestrationState)
+    workflow.add_node("prepare_inputs", oa.prepare_input_node)
+    workflow.add_node("technical_analyst", oa.technical_analyst_node)
+    workflow.add_node("business_analyst", oa.business_analyst_node)
+    workflow.add_node("report_agent", oa.report_agent_node)
+    workflow.set_entry_point("prepare_inputs")
+    workflow.add_edge("prepare_inputs", "technical_analyst")
+    workflow.add_edge("technical_analyst", "business_analyst")
+    workflow.add_edge("business_analyst", "report_agent")
+    workflow.add_edge("report_agent", END)
+    return workflow.compile()
+
+
+def time_graph(graph):
+    state = {
+        "raw_chat_history": [["user", "How is the ibis migration going?"]],
+        "knowledge_base_data": "no relevant data",
+        "current_query": "",
+        "technical_analysis": "",
+        "business_analysis": "",
+        "final_report": ""
+    }
+    timings = []
+    for _ in range(RUNS):
+        start = time.perf_counter()
+        asyncio.run(graph.ainvoke(state, {"recursion_limit": 10}))
+        timings.append(time.perf_counter() - start)
+    return min(timings)
+
+
+def main():
+    technical, business, report = stub_chain("technical"), stub_chain("business"), stub_chain("report")
+    oa.get_technical_analyst_chain = lambda: technical
+    oa.get_business_analyst_chain = lambda: business
+    oa.get_report_agent_chain = lambda: report
+
+    sequential = time_graph(build_sequential_graph())
+    parallel = time_graph(oa.get_graph())
+
+    print(f"stub LLM latency: {LLM_LATENCY:.2f}s, best of {RUNS} runs")
+    print(f"sequential graph: {sequential:.3f}s")
+    print(f"fan-out graph:    {parallel:.3f}s")
+    print(f"saved:            {sequential - parallel:.3f}s")
+
+
+if __name__ == "__main__":
+    main()
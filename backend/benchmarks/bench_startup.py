@@ -0,0 +1,50 @@
+"""Guards the app startup time.
+
+Imports the app and calls create_app() in fresh interpreters and fails if
+the best run exceeds MAX_STARTUP_SECONDS, or if any of the heavy libraries
+that are meant to load lazily got imported along the way. No database,
+Chroma server or Gemini key is needed.
+
+Run from the backend directory:
+    python -m benchmarks.bench_startup
+"""
+import sys
+import json
+import subprocess
+
+RUNS = 5
+MAX_STARTUP_SECONDS = 1.0
+LAZY_MODULES = ["sentence_transformers", "torch", "langchain_google_genai", "langgraph", "chromadb", "motor"]
+
+PROBE = f"""
+import sys, json, time
+start = time.perf_counter()
+from app import create_app
+create_app(warm_up=False)
+elapsed = time.perf_counter() - start
+loaded = [name for name in {LAZY_MODULES!r} if name in sys.modules]
+print(json.dumps({{"elapsed": elapsed, "loaded": loaded}}))
+"""
+
+
+def main():
+    runs = []
+    for _ in range(RUNS):
+        output = subprocess.run(
+            [sys.executable, "-c", PROBE],
+            capture_output=True, text=True, check=True
+        ).stdout
+        runs.append(json.loads(output.strip().splitlines()[-1]))
+
+    best = min(run["elapsed"] for run in runs)
+    loaded = sorted({name for run in runs for name in run["loaded"]})
+
+    print(f"create_app() best of {RUNS}: {best:.3f}s (limit {MAX_STARTUP_SECONDS:.1f}s)")
+    print(f"eagerly imported heavy modules: {', '.join(loaded) or 'none'}")
+
+    if best > MAX_STARTUP_SECONDS or loaded:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,129 @@
+"""Vector store modes compared on synthetic embeddings.
+
+Upserts random unit vectors with access_level / department metadata into
+each mode and measures upsert throughput, single-query latency with and
+without the access filter, and recall@k against exact search:
+
+  http        Chroma server on CHROMA_HOST:CHROMA_PORT (skipped when down)
+  persistent  embedded Chroma PersistentClient
+  numpy       in-process memory-mapped matrix, exact search
+
+Stores are created in a temporary directory (and a throwaway collection on
+the server) and removed afterwards. Run from the backend directory:
+    python -m benchmarks.bench_vector_store
+"""
+import time
+import shutil
+import asyncio
+import tempfile
+
+import numpy as np
+
+from app.config import CHROMA_HOST, CHROMA_PORT, CHROMA_ADD_BATCH_SIZE
+from app.vector_store import NumpyCollection, open_persistent_collection
+
+SIZES = [10_000, 100_000]
+DIMENSION = 384
+NUM_QUERIES = 200
+TOP_K = 30
+BENCH_COLLECTION = "bench_vector_store"
+ACCESS_FILTER = {"$and": [
+    {"access_level": {"$in": ["0", "1", "2", "3"]}},
+    {"department": {"$in": ["engineering", "unknown"]}}
+]}
+DEPARTMENTS = ["engineering", "sales", "finance", "unknown"]
+
+
+def make_data(size, rng):
+    vectors = rng.standard_normal((size, DIMENSION)).astype(np.float32)
+    vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+    metadatas = [
+        {"doc_id": f"data_{i}", "access_level": str(i % 6), "department": DEPARTMENTS[i % len(DEPARTMENTS)]}
+        for i in range(size)
+    ]
+    queries = rng.standard_normal((NUM_QUERIES, DIMENSION)).astype(np.float32)
+    queries /= np.linalg.norm(queries, axis=1, keepdims=True)
+    return vectors, metadatas, queries
+
+
+def exact_top_k(vectors, metadatas, queries, where):
+    allowed = np.ones(len(vectors), dtype=bool)
+    if where:
+        levels = {"0", "1", "2", "3"}
+        departments = {"engineering", "unknown"}
+        allowed = np.array([m["access_level"] in levels and m["department"] in departments for m in metadatas])
+    scores = queries @ vectors.T
+    scores[:, ~allowed] = -np.inf
+    return [set(f"data_{i}#0" for i in np.argsort(-row)[:TOP_K]) for row in scores]
+
+
+async def open_http():
+    import chromadb
+    client = await chromadb.AsyncHttpClient(host=CHROMA_HOST, port=CHROMA_PORT)
+    try:
+        await client.delete_collection(BENCH_COLLECTION)
+    except Exception:
+        pass
+    collection = await client.get_or_create_collection(name=BENCH_COLLECTION, metadata={"hnsw:space": "cosine"})
+
+    async def close():
+        await client.delete_collection(BENCH_COLLECTION)
+    return collection, close
+
+
+async def open_persistent(path):
+    collection = await asyncio.to_thread(open_persistent_collection, path, BENCH_COLLECTION)
+    return collection, None
+
+
+async def open_numpy(path):
+    return NumpyCollection(path), None
+
+
+async def run_mode(name, collection, vectors, metadatas, queries):
+    ids = [f"data_{i}#0" for i in range(len(vectors))]
+    start = time.perf_counter()
+    for begin in range(0, len(vectors), CHROMA_ADD_BATCH_SIZE):
+        end = begin + CHROMA_ADD_BATCH_SIZE
+        await collection.upsert(ids=ids[begin:end], embeddings=vectors[begin:end], metadatas=metadatas[begin:end])
+    upsert_rate = len(vectors) / (time.perf_counter() - start)
+
+    line = f"{name:>10}: {upsert_rate:9.0f} upserts/s"
+    for label, where in (("all", None), ("filtered", ACCESS_FILTER)):
+        expected = exact_top_k(vectors, metadatas, queries, where)
+        timings, found = [], []
+        for query in queries:
+            start = time.perf_counter()
+            results = await collection.query(query_embeddings=[query], n_results=TOP_K, where=where, include=["distances"])
+            timings.append(time.perf_counter() - start)
+            found.append(set(results["ids"][0]))
+        timings = np.array(timings) * 1000
+        recall = np.mean([len(a & b) / TOP_K for a, b in zip(found, expected)])
+        line += (f"  {label} p50 {np.percentile(timings, 50):6.2f}ms p95 {np.percentile(timings, 95):6.2f}ms"
+                 f" recall {recall:.3f}")
+    print(line)
+
+
+async def main():
+    rng = np.random.default_rng(0)
+    for size in SIZES:
+        vectors, metadatas, queries = make_data(size, rng)
+        print(f"{size} vectors of dimension {DIMENSION}, top {TOP_K}")
+        for name, opener in (("http", open_http), ("persistent", open_persistent), ("numpy", open_numpy)):
+            path = tempfile.mkdtemp(prefix=f"bench_{name}_")
+            try:
+                collection, close = await (opener() if name == "http" else opener(path))
+            except Exception as e:
+                print(f"{name:>10}: skipped ({e})")
+                shutil.rmtree(path, ignore_errors=True)
+                continue
+            try:
+                await run_mode(name, collection, vectors, metadatas, queries)
+            finally:
+                if close is not None:
+                    await close()
+                shutil.rmtree(path, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
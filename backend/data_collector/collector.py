@@ -1,62 +1,147 @@
-from mail_collector import get_gmail_messages 
-from slack_collector import get_all_messages
-
-
-
-slack_messages = get_all_messages()
-
-
-'''
-    doc_text = data.get("text")
-    if not doc_text:
-        return jsonify({"error": "No document text received."}), 400
-    document = {
-        "_id": doc_id,
-        "text": doc_text,
-        "department": data.get("department", "unknown"),
-        "source": data.get("source", "unknown"),
-        "created_at": get_timestamp(),
-        "employees": data.get("employees"),
-        "access_level": data.get("access_level"),
-        "company_name": data.get("company_name", "unknown")
-    }'''
-
-
-gmail_emails = [ 
-    {
-        "text": email.snippet,
-        "department": "unknown",
-        "source": email.sender,
-        "created_at": email.date,
-        "access_level": "3",
-        "company_name": "infinidev",
-    }
-    
-    for email in get_gmail_messages()]
-
-#call /add_document api 
+from mail_collector import iter_gmail_messages, clean_body, save_sync_state as save_gmail_state
+from slack_collector import iter_slack_records
 
-import requests
 import json
 import time
+import queue
+import logging
+import threading
+import requests
+from functools import partial
+
+
+# Records waiting for ingestion, sources block once it is full so a slow
+# embedder holds the collection back instead of filling up memory.
+# Besides records, sources put checkpoints on it: callables saving their
+# sync state, run once /add_documents accepted every record before them
+QUEUE_SIZE = 2000
+INGEST_BATCH_SIZE = 500
+DONE = object()
+
+
+def iter_gmail_records():
+    synced = []
+    for email in iter_gmail_messages(save_state=synced.append):
+        yield {
+            "source_id": f"gmail:{email.id}",
+            "text": f"{email.subject}\n\n{clean_body(email)}" if email.subject else clean_body(email),
+            "department": "unknown",
+            "source": email.sender,
+            "created_at": email.date,
+            "access_level": "3",
+            "company_name": "infinidev",
+        }
+    for state in synced:
+        yield partial(save_gmail_state, state)
+
+
+#call /add_documents api
 
+session = requests.Session()
 
-def add_document_to_api(documents):
-    url = "http://http://127.0.0.1:5000/add_document"  # Replace with your API endpoint
+
+def add_document_to_api(documents, batch_size=1000):
+    """ Raises unless every record was stored or rejected as invalid, records
+        that failed on the server's side have to be collected again """
+    url = "http://127.0.0.1:5000/add_documents"  # Replace with your API endpoint
     headers = {
         "Content-Type": "application/json"
     }
-    for document in documents:
-        response = requests.post(url, headers=headers, data=json.dumps(document))
-        
-        if response.status_code == 200:
-            print("Document added successfully:", response.json())
+    for start in range(0, len(documents), batch_size):
+        batch = documents[start:start + batch_size]
+        response = session.post(url, headers=headers, data=json.dumps(batch, default=str))
+
+        try:
+            result = response.json()
+        except ValueError:
+            result = None
+        if not isinstance(result, dict) or "results" not in result:
+            raise requests.HTTPError(
+                f"Failed to add documents: {response.status_code} {response.text}", response=response
+            )
+
+        print(f"Documents added: {result['added']}, failed: {result['failed']}")
+        retryable = 0
+        for item in result["results"]:
+            if "error" in item:
+                print("Failed to add document:", start + item["index"], item["error"])
+                retryable += bool(item.get("retryable"))
+        if response.status_code != 200 or retryable:
+            raise requests.HTTPError(
+                f"Failed to add documents: {response.status_code}, {retryable} failed on the server", response=response
+            )
+
+
+def produce(source, records, stopped):
+    """ Puts every record of `source` on the queue, blocking while it is full,
+        until `stopped` is set """
+    try:
+        for record in source():
+            if stopped.is_set():
+                return
+            records.put(record)
+    except Exception as e:
+        logging.error(f"Collecting from {source.__name__} failed: {e}")
+    finally:
+        records.put(DONE)
+
+def iter_batches(records, num_sources, batch_size):
+    """ Yields (batch, checkpoints), the checkpoints may run once the batch
+        was added. A source's records come off the queue in order, so the
+        ones before a checkpoint are in this batch or in one already added """
+    batch, checkpoints = [], []
+    while num_sources:
+        record = records.get()
+        if record is DONE:
+            num_sources -= 1
+            continue
+        if callable(record):
+            checkpoints.append(record)
+            if batch:
+                continue
         else:
-            print("Failed to add document:", response.status_code, response.text)
-        
+            batch.append(record)
+            if len(batch) < batch_size:
+                continue
+        yield batch, checkpoints
+        batch, checkpoints = [], []
+    if batch or checkpoints:
+        yield batch, checkpoints
+
+def run_pipeline(sources, batch_size=INGEST_BATCH_SIZE, queue_size=QUEUE_SIZE):
+    """ Streams the records of all sources through a bounded queue into
+        /add_documents, one batch at a time """
+    records = queue.Queue(maxsize=queue_size)
+    stopped = threading.Event()
+    producers = [
+        threading.Thread(target=produce, args=(source, records, stopped), name=source.__name__, daemon=True)
+        for source in sources
+    ]
+    for producer in producers:
+        producer.start()
+    try:
+        for batch, checkpoints in iter_batches(records, len(sources), batch_size):
+            if batch:
+                add_document_to_api(batch, batch_size)
+            for checkpoint in checkpoints:
+                checkpoint()
+    finally:
+        # after a failed batch, keep taking records off the queue until the
+        # sources notice they were stopped, their sync state stays unsaved
+        stopped.set()
+        while any(producer.is_alive() for producer in producers):
+            try:
+                records.get(timeout=1)
+            except queue.Empty:
+                pass
+
+
 if __name__ == "__main__":
     # Add emails and messages to the API
     while True:
-        add_document_to_api(gmail_emails)
-        add_document_to_api(slack_messages)
+        try:
+            run_pipeline([iter_gmail_records, iter_slack_records])
+        except Exception as e:
+            # nothing after the failed batch was checkpointed, the next run collects it again
+            logging.error(f"Collection run failed: {e}")
         time.sleep(7 * 24 * 60 * 60)  # Sleep for 1 week
@@ -1,21 +1,225 @@
+import os
+import re
+import html
+import json
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from googleapiclient.errors import HttpError
 from simplegmail import Gmail
 from simplegmail.query import construct_query
 
 
 
-def get_gmail_messages():
-    gmail = Gmail(
+PAGE_SIZE = 100
+# Message bodies are fetched concurrently, one API client per worker thread
+MAX_WORKERS = int(os.environ.get("GMAIL_MAX_WORKERS", 8))
+# How far back the first run goes, 0 collects the whole mailbox
+BACKFILL_DAYS = int(os.environ.get("GMAIL_BACKFILL_DAYS", 0))
+# History id and newest message id of the previous run
+SYNC_STATE_FILE = "gmail_sync_state.json"
+SKIPPED_LABELS = {"DRAFT", "SPAM", "TRASH"}
+
+# Lines a quoted reply starts with, everything from there on is dropped
+QUOTE_HEADERS = re.compile(
+    r"^(On .+ wrote:|-{2,}\s*Original Message\s*-{2,}|-{2,}\s*Forwarded message\s*-{2,}|_{10,})$",
+    re.IGNORECASE
+)
+# A "From:" line only starts a quoted reply when the header block follows it
+QUOTE_FROM = re.compile(r"^From: .+$", re.IGNORECASE)
+QUOTE_FIELDS = re.compile(r"^(Sent|Date|To|Cc|Subject): ", re.IGNORECASE)
+# The signature delimiter, everything from there on is dropped
+SIGNATURE = re.compile(r"^-- ?$")
+# Boilerplate footers and unsubscribe lines, everything from the first matching
+# line on is dropped, but only when it starts a block of the last lines:
+# "Copyright 2024 matters for our licensing doc" in a body is kept
+FOOTERS = re.compile(
+    r"^(You received this (e-?mail|message)|You are receiving this|To stop receiving"
+    r"|©|\(c\) \d{4}|Copyright \d{4}|Sent from my \w+|This (e-?mail|message) .*confidential)",
+    re.IGNORECASE
+)
+UNSUBSCRIBE = re.compile(r"\bunsubscribe\b", re.IGNORECASE)
+FOOTER_TAIL_LINES = 5
+# Mobile clients append this right below the text, on the last line
+SENT_FROM = re.compile(r"^Sent from my \w+", re.IGNORECASE)
+
+
+def get_gmail():
+    return Gmail(
         client_secret_file = "../../../client_secret.json",
         creds_file = "../../../gmail_token.json",
     )
 
-    query_params = {
-        "newer_than": (1, "week"),
-        "older_than": (0, "year")
-    }
 
-    messages = gmail.get_messages()
-    return messages
+def load_sync_state():
+    if not os.path.exists(SYNC_STATE_FILE):
+        return {}
+    with open(SYNC_STATE_FILE) as f:
+        return json.load(f)
+
+def save_sync_state(state):
+    tmp_file = f"{SYNC_STATE_FILE}.tmp"
+    with open(tmp_file, "w") as f:
+        json.dump(state, f, indent=2)
+    os.replace(tmp_file, SYNC_STATE_FILE)
+
+
+def iter_listed_refs(gmail, query="", stop_at=None):
+    """Yield pages of message refs matching `query`, newest first, up to `stop_at`"""
+    page_token = None
+    while True:
+        response = gmail.service.users().messages().list(
+            userId="me", q=query, maxResults=PAGE_SIZE, pageToken=page_token
+        ).execute()
+        refs = response.get("messages", [])
+        ids = [ref["id"] for ref in refs]
+        if stop_at in ids:
+            yield refs[:ids.index(stop_at)]
+            return
+        yield refs
+        page_token = response.get("nextPageToken")
+        if not page_token:
+            return
+
+def iter_history_refs(gmail, start_history_id):
+    """Yield pages of refs of the messages added since `start_history_id`"""
+    page_token = None
+    while True:
+        response = gmail.service.users().history().list(
+            userId="me", startHistoryId=start_history_id, historyTypes=["messageAdded"],
+            maxResults=PAGE_SIZE, pageToken=page_token
+        ).execute()
+        yield [
+            added["message"]
+            for record in response.get("history", [])
+            for added in record.get("messagesAdded", [])
+            if not SKIPPED_LABELS & set(added["message"].get("labelIds", []))
+        ]
+        page_token = response.get("nextPageToken")
+        if not page_token:
+            return
+
+
+class MessageFetcher:
+    """Fetches full messages on a thread pool, the API client is not thread
+    safe so every worker builds its own from the shared credentials"""
+
+    def __init__(self, gmail, max_workers=MAX_WORKERS):
+        self.gmail = gmail
+        self.local = threading.local()
+        self.pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="gmail")
+
+    def fetch(self, ref):
+        """The full message, None when it was deleted after being listed"""
+        client = getattr(self.local, "gmail", None)
+        if client is None:
+            client = self.local.gmail = Gmail(credentials=self.gmail.creds)
+        try:
+            return client._build_message_from_ref("me", ref, attachments="ignore")
+        except HttpError as e:
+            if e.resp.status != 404:
+                raise
+            logging.info(f"Gmail message {ref['id']} is gone, skipping it")
+            return None
+
+    def fetch_many(self, refs):
+        return self.pool.map(self.fetch, refs)
+
+
+def iter_gmail_messages(query=None, save_state=save_sync_state):
+    """Yield the messages received since the last run, newest first
+
+    Uses the Gmail history from the history id saved by the previous run, and
+    falls back to listing the mailbox down to the last message seen when
+    there is no saved state or the history id expired. A given `query`
+    always lists and leaves the saved state alone.
+
+    Once every message was yielded the new sync state is passed to
+    `save_state`, a caller that stores the messages later passes a function
+    that holds on to it until they are stored.
+    """
+    gmail = get_gmail()
+    fetcher = MessageFetcher(gmail)
+    state = {} if query is not None else load_sync_state()
+    # taken up front, messages arriving during the run are picked up next time
+    history_id = gmail.service.users().getProfile(userId="me").execute()["historyId"]
+
+    newest = {}
+
+    def iter_refs():
+        if state.get("history_id"):
+            try:
+                # history pages run oldest to newest
+                for refs in iter_history_refs(gmail, state["history_id"]):
+                    if refs:
+                        newest["id"] = refs[-1]["id"]
+                    yield refs
+                return
+            except HttpError as e:
+                if e.resp.status != 404:
+                    raise
+                logging.warning("Gmail history id expired, listing messages down to the last one seen")
+        initial_query = construct_query(newer_than=(BACKFILL_DAYS, "day")) if BACKFILL_DAYS else ""
+        # listed pages run newest to oldest
+        for refs in iter_listed_refs(gmail, query or initial_query, stop_at=state.get("last_message_id")):
+            if refs:
+                newest.setdefault("id", refs[0]["id"])
+            yield refs
+
+    seen = set()
+    for refs in iter_refs():
+        refs = [ref for ref in refs if ref["id"] not in seen]
+        seen.update(ref["id"] for ref in refs)
+        for message in fetcher.fetch_many(refs):
+            if message is not None:
+                yield message
+
+    fetcher.pool.shutdown()
+    if query is None:
+        save_state({
+            "history_id": history_id,
+            "last_message_id": newest.get("id", state.get("last_message_id"))
+        })
+
+
+def clean_body(message):
+    """The plain-text body of a message without quoted replies, footers,
+    image placeholders and tracking links"""
+    text = message.plain
+    if not text and message.html:
+        text = html.unescape(re.sub(r"<(style|script)[^>]*>.*?</\1>|<[^>]+>", " ", message.html, flags=re.S))
+    if not text:
+        return message.snippet or ""
+
+    text = text.replace("\r\n", "\n")
+    # "On <date>, <name> wrote:" is often wrapped over two lines
+    text = re.sub(r"^(On .+)\n(.*wrote:)$", r"\1 \2", text, flags=re.M)
+
+    all_lines = [line.strip() for line in text.split("\n")]
+    filled = [i for i, line in enumerate(all_lines) if line]
+    tail_start = filled[-FOOTER_TAIL_LINES] if len(filled) >= FOOTER_TAIL_LINES else 0
+
+    lines = []
+    for i, stripped in enumerate(all_lines):
+        if QUOTE_HEADERS.match(stripped) or SIGNATURE.match(stripped):
+            break
+        if QUOTE_FROM.match(stripped) and any(QUOTE_FIELDS.match(line) for line in all_lines[i + 1:i + 4]):
+            break
+        starts_tail_block = i >= tail_start and lines and not all_lines[i - 1]
+        if starts_tail_block and (FOOTERS.match(stripped) or UNSUBSCRIBE.search(stripped)):
+            break
+        if i == filled[-1] and SENT_FROM.match(stripped):
+            break
+        if stripped.startswith(">"):
+            continue
+        stripped = re.sub(r"\[image: [^\]]*\]|<https?://[^>]*>", "", stripped).strip()
+        lines.append(stripped)
+
+    return re.sub(r"\n{3,}", "\n\n", "\n".join(lines)).strip() or message.snippet or ""
+
+
+def get_gmail_messages():
+    return list(iter_gmail_messages())
 
 
 if __name__ == "__main__":
@@ -27,7 +231,7 @@ if __name__ == "__main__":
         print("Subject: " + message.subject)
         print("Date: " + message.date)
         print("Preview: " + message.snippet)
-        
+
         with open("email_samples.txt", "a") as f:
             if message.plain:
                 if len(message.plain) < 1000:
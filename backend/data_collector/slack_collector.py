@@ -1,11 +1,18 @@
 import os
 import json
-from datetime import datetime
+import uuid
+from datetime import datetime, timezone
 from dotenv import load_dotenv
 import slack_sdk
 import time
+import threading
 import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+import pyarrow.dataset as ds
 import logging
+from functools import partial
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
 
 # Set up logging
 logging.basicConfig(
@@ -30,15 +37,110 @@ if not SLACK_TOKEN:
 # Initialize Slack client
 client = slack_sdk.WebClient(token=SLACK_TOKEN)
 
+# Channels (and the thread replies of each channel) are fetched concurrently
+MAX_WORKERS = int(os.environ.get("SLACK_MAX_WORKERS", 8))
+MAX_RETRIES = 5
+
+# Requests per minute allowed by each Slack rate limit tier
+TIER_RATES = {1: 1, 2: 20, 3: 50, 4: 100}
+METHOD_TIERS = {
+    "auth_test": 4,
+    "users_list": 2,
+    "conversations_list": 2,
+    "conversations_join": 3,
+    "conversations_history": 3,
+    "conversations_replies": 3,
+}
+
+
+class TokenBucket:
+    """Thread-safe token bucket refilled at `rate_per_minute`"""
+
+    def __init__(self, rate_per_minute, burst=None):
+        self.rate = rate_per_minute / 60
+        self.capacity = burst or max(1, rate_per_minute // 10)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.paused_until = 0
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if now >= self.paused_until and self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = max(self.paused_until - now, (1 - self.tokens) / self.rate)
+            time.sleep(wait)
+
+    def pause(self, seconds):
+        """Hold every caller back for `seconds`, after Slack answered with a 429"""
+        with self.lock:
+            self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+            self.tokens = 0
+
+
+# Slack rate limits apply per method, each bucket runs at its method's tier rate
+buckets = {method: TokenBucket(TIER_RATES[tier]) for method, tier in METHOD_TIERS.items()}
+buckets_lock = threading.Lock()
+
+# Separate pool for thread replies, channel workers wait on it
+reply_pool = ThreadPoolExecutor(max_workers=MAX_WORKERS, thread_name_prefix="slack-replies")
+
+def call_slack(method, **params):
+    """Call a WebClient method through its rate limiter, retrying on 429s after Retry-After"""
+    with buckets_lock:
+        bucket = buckets.setdefault(method, TokenBucket(TIER_RATES[3]))
+    for attempt in range(MAX_RETRIES):
+        bucket.acquire()
+        try:
+            return getattr(client, method)(**params)
+        except slack_sdk.errors.SlackApiError as e:
+            if e.response.status_code != 429 or attempt == MAX_RETRIES - 1:
+                raise
+            headers = e.response.headers or {}
+            retry_after = int(headers.get("Retry-After", headers.get("retry-after", 1)))
+            logging.warning(f"Rate limited on {method}, retrying in {retry_after}s")
+            bucket.pause(retry_after)
+
 # Create output directory if it doesn't exist
 os.makedirs("slack_data", exist_ok=True)
+
+# High-water marks of previous runs, so each run only fetches new activity
+SYNC_STATE_FILE = "slack_data/sync_state.json"
+# How far back parents are re-read to notice new replies in their threads
+THREAD_LOOKBACK_DAYS = int(os.environ.get("SLACK_THREAD_LOOKBACK_DAYS", 30))
+
+# Append-only message store, Parquet files partitioned by channel and day
+MESSAGES_DIR = "slack_data/messages"
+MESSAGE_SCHEMA = pa.schema([
+    ("channel", pa.string()),
+    ("day", pa.string()),
+    ("ts", pa.string()),
+    ("thread_ts", pa.string()),
+    ("user", pa.string()),
+    ("text", pa.string()),
+    ("reply_count", pa.int64()),
+    ("latest_reply", pa.string()),
+    ("reactions", pa.string()),
+    ("has_files", pa.bool_()),
+    ("has_attachments", pa.bool_()),
+    ("fetched_at", pa.float64()),
+    ("raw", pa.string()),
+])
+MESSAGE_PARTITIONING = ds.partitioning(
+    pa.schema([("channel", pa.string()), ("day", pa.string())]), flavor="hive"
+)
 def join_all_channels():
     channels = fetch_all_channels()
     for channel in channels:
         try:
-            client.conversations_join(channel=channel["id"])
+            call_slack("conversations_join", channel=channel["id"])
             print(f"Joined: {channel['name']}")
-        except SlackApiError as e:
+        except slack_sdk.errors.SlackApiError as e:
             print(f"Error joining {channel['name']}: {e.response['error']}")
 
 def fetch_all_users():
@@ -49,21 +151,15 @@ def fetch_all_users():
         cursor = None
         
         while True:
-            response = client.users_list(limit=200, cursor=cursor) if cursor else client.users_list(limit=200)
+            response = call_slack("users_list", limit=200, cursor=cursor) if cursor else call_slack("users_list", limit=200)
             users.extend(response["members"])
             
             cursor = response.get("response_metadata", {}).get("next_cursor")
             if not cursor:
                 break
-                
-            # Respect rate limits
-            time.sleep(1)
+
         
-        # Save users to file
-        with open("slack_data/users.json", "w") as f:
-            json.dump(users, f, indent=2)
-            
-        # Create a more readable CSV with key user information
+        # Save users with their key fields as columns, the full record stays in raw
         user_data = []
         for user in users:
             user_data.append({
@@ -76,11 +172,11 @@ def fetch_all_users():
                 "phone": user.get("profile", {}).get("phone"),
                 "is_admin": user.get("is_admin", False),
                 "is_bot": user.get("is_bot", False),
-                "updated": user.get("updated")
+                "updated": user.get("updated"),
+                "raw": json.dumps(user)
             })
             
-        df = pd.DataFrame(user_data)
-        df.to_csv("slack_data/users.csv", index=False)
+        write_snapshot(user_data, "slack_data/users.parquet")
             
         logging.info(f"Successfully fetched and saved {len(users)} users")
         return users
@@ -98,26 +194,21 @@ def fetch_all_channels():
         
         # Get public channels
         while True:
-            response = client.conversations_list(
+            response = call_slack(
+                "conversations_list",
                 types="public_channel", 
                 limit=200,
                 cursor=cursor
-            ) if cursor else client.conversations_list(types="public_channel", limit=200)
+            ) if cursor else call_slack("conversations_list", types="public_channel", limit=200)
             
             channels.extend(response["channels"])
             
             cursor = response.get("response_metadata", {}).get("next_cursor")
             if not cursor:
                 break
-                
-            # Respect rate limits
-            time.sleep(1)
+
         
-        # Save channels to file
-        with open("slack_data/channels.json", "w") as f:
-            json.dump(channels, f, indent=2)
-            
-        # Create a more readable CSV with key channel information
+        # Save channels with their key fields as columns, the full record stays in raw
         channel_data = []
         for channel in channels:
             channel_data.append({
@@ -129,11 +220,11 @@ def fetch_all_channels():
                 "creator": channel.get("creator"),
                 "topic": channel.get("topic", {}).get("value", ""),
                 "purpose": channel.get("purpose", {}).get("value", ""),
-                "num_members": channel.get("num_members", 0)
+                "num_members": channel.get("num_members", 0),
+                "raw": json.dumps(channel)
             })
             
-        df = pd.DataFrame(channel_data)
-        df.to_csv("slack_data/channels.csv", index=False)
+        write_snapshot(channel_data, "slack_data/channels.parquet")
             
         logging.info(f"Successfully fetched and saved {len(channels)} channels")
         return channels
@@ -144,118 +235,265 @@ def fetch_all_channels():
 
     
 
-def get_all_messages():
-    messages = fetch_all_channels()
-    # map each user id to their email
-    user_map = {}
-    for user in fetch_all_users():
-        user_map[user["id"]] = user["profile"]["real_name"]
-    
-    # go through the messages and replace the user id with their email
-    for message in messages:
-        if "user" in message:
-            message["user"] = user_map.get(message["user"], message["user"])
-        if "replies" in message:
-            for reply in message["replies"]:
-                reply["user"] = user_map.get(reply["user"], reply["user"])
-    
-    return messages
+def iter_channel_messages(channels):
+    """Yield (channel, new messages, commit) for every active channel as it finishes
+
+    At most MAX_WORKERS channels are fetched at a time and the next one only
+    starts once a finished channel was consumed, so a slow consumer holds the
+    collection back instead of piling up fetched messages. Each worker gets
+    its own copy of the channel's sync state, calling commit() saves it, which
+    the consumer does once the messages are stored. A channel that is never
+    committed is fetched again from its previous high-water mark next run.
+    """
+    sync_state = load_sync_state()
+    sync_lock = threading.Lock()
+
+    def commit(channel_id, channel_state):
+        with sync_lock:
+            sync_state[channel_id] = channel_state
+            save_sync_state(sync_state)
+
+    pending = iter([channel for channel in channels if not channel.get("is_archived")])
+    with ThreadPoolExecutor(max_workers=MAX_WORKERS, thread_name_prefix="slack-channel") as pool:
+        futures = {}
+        
+        def submit_next():
+            channel = next(pending, None)
+            if channel is not None:
+                channel_state = json.loads(json.dumps(sync_state.get(channel["id"], {})))
+                future = pool.submit(fetch_channel_messages, channel["id"], channel["name"], channel_state)
+                futures[future] = (channel, channel_state)
+        
+        for _ in range(MAX_WORKERS):
+            submit_next()
+        while futures:
+            done, _ = wait(futures, return_when=FIRST_COMPLETED)
+            for future in done:
+                channel, channel_state = futures.pop(future)
+                yield channel, future.result(), partial(commit, channel["id"], channel_state)
+                submit_next()
 
+def build_record(msg, channel, user_names):
+    """Turn a Slack message into an /add_documents record"""
+    return {
+        "source_id": f"slack:{channel['id']}:{msg['ts']}",
+        "text": msg.get("text"),
+        "department": "unknown",
+        "source": user_names.get(msg.get("user"), msg.get("user", "unknown")),
+        "created_at": datetime.fromtimestamp(float(msg["ts"])).strftime('%Y-%m-%d %H:%M:%S'),
+        "access_level": "3",
+        "company_name": "infinidev",
+    }
 
+def iter_slack_records():
+    """Yield a record for every message and thread reply posted since the last run,
+    each channel's records are followed by the callable that saves its sync state"""
+    # map each user id to their real name
+    user_names = {user["id"]: user.get("profile", {}).get("real_name") for user in fetch_all_users()}
+    for channel, messages, commit in iter_channel_messages(fetch_all_channels()):
+        for msg in messages:
+            if msg.get("text"):
+                yield build_record(msg, channel, user_names)
+        yield commit
+
+
+
+def load_sync_state():
+    """Load the per-channel high-water marks of previous runs"""
+    if not os.path.exists(SYNC_STATE_FILE):
+        return {}
+    with open(SYNC_STATE_FILE) as f:
+        return json.load(f)
+
+def save_sync_state(state):
+    """Save the high-water marks, atomically so a crash can't corrupt them"""
+    tmp_file = f"{SYNC_STATE_FILE}.tmp"
+    with open(tmp_file, "w") as f:
+        json.dump(state, f, indent=2)
+    os.replace(tmp_file, SYNC_STATE_FILE)
+
+def write_snapshot(rows, path):
+    """Replace a small snapshot table (users, channels) with one atomic write"""
+    tmp_file = f"{path}.tmp"
+    pd.DataFrame(rows).to_parquet(tmp_file, index=False)
+    os.replace(tmp_file, path)
+
+def message_row(msg, channel_id, fetched_at):
+    return {
+        "channel": channel_id,
+        "day": datetime.fromtimestamp(float(msg["ts"]), timezone.utc).strftime('%Y-%m-%d'),
+        "ts": msg.get("ts"),
+        "thread_ts": msg.get("thread_ts"),
+        "user": msg.get("user"),
+        "text": msg.get("text"),
+        "reply_count": msg.get("reply_count", 0),
+        "latest_reply": msg.get("latest_reply"),
+        "reactions": json.dumps(msg.get("reactions", [])),
+        "has_files": "files" in msg,
+        "has_attachments": "attachments" in msg,
+        "fetched_at": fetched_at,
+        "raw": json.dumps(msg)
+    }
 
-def fetch_channel_messages(channel_id, channel_name):
-    """Fetch and save messages from a specific channel"""
+def append_messages(channel_id, messages):
+    """Append messages and thread replies to the store as new Parquet files,
+    one per channel and day, earlier files are never rewritten"""
+    if not messages:
+        return
+    fetched_at = time.time()
+    table = pa.Table.from_pylist(
+        [message_row(msg, channel_id, fetched_at) for msg in messages],
+        schema=MESSAGE_SCHEMA
+    )
+    pq.write_to_dataset(
+        table,
+        MESSAGES_DIR,
+        partitioning=MESSAGE_PARTITIONING,
+        basename_template=f"part-{int(fetched_at * 1000)}-{uuid.uuid4().hex[:8]}-{{i}}.parquet"
+    )
+
+def scan_messages(columns=None, channel_id=None, since_day=None):
+    """Lazily scan the message store, reading only `columns` of the partitions
+    that match channel_id and since_day (YYYY-MM-DD)
+
+    The store is append-only, a message fetched again by a later run (edited,
+    or a thread parent whose replies moved) has one row per fetch, the one
+    with the newest fetched_at is current. load_messages resolves that.
+    """
+    if not os.path.exists(MESSAGES_DIR):
+        return None
+    conditions = []
+    if channel_id:
+        conditions.append(ds.field("channel") == channel_id)
+    if since_day:
+        conditions.append(ds.field("day") >= since_day)
+    condition = None
+    for c in conditions:
+        condition = c if condition is None else condition & c
+    dataset = ds.dataset(MESSAGES_DIR, format="parquet", partitioning=MESSAGE_PARTITIONING)
+    return dataset.scanner(columns=columns, filter=condition)
+
+def load_messages(columns=None, channel_id=None, since_day=None):
+    """Load the current copy of every stored message as a DataFrame"""
+    keys = ["channel", "ts", "fetched_at"]
+    scan_columns = None if columns is None else list(dict.fromkeys(keys + list(columns)))
+    scanner = scan_messages(scan_columns, channel_id, since_day)
+    if scanner is None:
+        return pd.DataFrame(columns=columns or MESSAGE_SCHEMA.names)
+    df = scanner.to_table().to_pandas()
+    df = df.sort_values("fetched_at").drop_duplicates(["channel", "ts"], keep="last")
+    return df if columns is None else df[list(columns)]
+
+def fetch_channel_messages(channel_id, channel_name, channel_state=None):
+    """Fetch the messages of a channel that are new since the last run and
+    append them to the message store, returns the new messages followed by
+    the new thread replies
+
+    channel_state holds the channel's high-water marks and is updated in place:
+    latest_ts is the newest message seen, threads maps each thread's ts to the
+    latest_reply seen. Parents posted within THREAD_LOOKBACK_DAYS of latest_ts
+    are re-read so their latest_reply can be compared, and only threads where
+    it changed get their new replies fetched.
+    """
     logging.info(f"Fetching messages for channel: {channel_name} ({channel_id})")
+    if channel_state is None:
+        channel_state = {}
+    latest_ts = channel_state.get("latest_ts")
+    seen_threads = channel_state.setdefault("threads", {})
     
     try:
-        # Create folder for this channel if it doesn't exist
-        channel_dir = f"slack_data/channels/{channel_name}"
-        os.makedirs(channel_dir, exist_ok=True)
+        oldest = None
+        if latest_ts:
+            oldest = str(max(float(latest_ts) - THREAD_LOOKBACK_DAYS * 24 * 60 * 60, 0))
         
         messages = []
         cursor = None
         
         while True:
-            # Get conversation history
-            response = client.conversations_history(
-                channel=channel_id,
-                limit=100,
-                cursor=cursor
-            ) if cursor else client.conversations_history(channel=channel_id, limit=100)
+            # Get conversation history, only what was posted after `oldest`
+            params = {"channel": channel_id, "limit": 200}
+            if oldest:
+                params["oldest"] = oldest
+            if cursor:
+                params["cursor"] = cursor
+            response = call_slack("conversations_history", **params)
             
             messages.extend(response["messages"])
             
             cursor = response.get("response_metadata", {}).get("next_cursor")
             if not cursor:
                 break
-                
-            # Respect rate limits
-            time.sleep(1)
+
         
-        # Save messages to file
-        with open(f"{channel_dir}/messages.json", "w") as f:
-            json.dump(messages, f, indent=2)
-            
-        # Create a more readable CSV with key message information
-        message_data = []
-        for msg in messages:
-            message_data.append({
-                "ts": msg.get("ts"),
-                "datetime": datetime.fromtimestamp(float(msg.get("ts", 0))).strftime('%Y-%m-%d %H:%M:%S'),
-                "user": msg.get("user"),
-                "text": msg.get("text"),
-                "thread_ts": msg.get("thread_ts"),
-                "reply_count": msg.get("reply_count", 0),
-                "reactions": json.dumps(msg.get("reactions", [])),
-                "has_files": "files" in msg,
-                "has_attachments": "attachments" in msg
-            })
-            
-        df = pd.DataFrame(message_data)
-        df.to_csv(f"{channel_dir}/messages.csv", index=False)
-            
-        logging.info(f"Successfully fetched and saved {len(messages)} messages from {channel_name}")
+        new_messages = [msg for msg in messages if not latest_ts or float(msg["ts"]) > float(latest_ts)]
+        logging.info(f"Fetched {len(new_messages)} new messages from {channel_name}")
         
-        # Fetch replies to threaded messages
+        # Fetch new replies of the threads whose latest_reply moved, concurrently
+        changed_threads = [
+            msg for msg in messages
+            # This is a parent message with replies
+            if msg.get("thread_ts") and msg.get("thread_ts") == msg.get("ts")
+            and not (msg.get("latest_reply") and msg.get("latest_reply") == seen_threads.get(msg["ts"]))
+        ]
         threads = {}
-        for msg in messages:
-            if msg.get("thread_ts") and msg.get("thread_ts") == msg.get("ts"):
-                # This is a parent message with replies
-                fetch_thread_replies(channel_id, msg["ts"], channel_dir, threads)
+        list(reply_pool.map(
+            lambda msg: fetch_thread_replies(channel_id, msg["ts"], threads, oldest=seen_threads.get(msg["ts"])),
+            changed_threads
+        ))
+        
+        # conversations_replies always includes the parent, keep only the replies
+        new_replies = [
+            reply for thread_ts, replies in threads.items() for reply in replies
+            if reply["ts"] != thread_ts and float(reply["ts"]) > float(seen_threads.get(thread_ts) or 0)
+        ]
         
-        # Save all threads
-        if threads:
-            with open(f"{channel_dir}/threads.json", "w") as f:
-                json.dump(threads, f, indent=2)
+        # Store what is new, plus the older messages that changed since the last
+        # run: edited ones and thread parents whose reply count moved
+        new_ts = {msg["ts"] for msg in new_messages}
+        changed_ts = {msg["ts"] for msg in changed_threads}
+        updated_messages = [
+            msg for msg in messages
+            if msg["ts"] not in new_ts and (
+                msg["ts"] in changed_ts
+                or (latest_ts and float(msg.get("edited", {}).get("ts", 0)) > float(latest_ts))
+            )
+        ]
+        append_messages(channel_id, new_messages + updated_messages + new_replies)
         
-        return messages
+        for msg in changed_threads:
+            if msg["ts"] in threads:
+                seen_threads[msg["ts"]] = msg.get("latest_reply")
+        if messages:
+            newest_ts = max(messages, key=lambda msg: float(msg["ts"]))["ts"]
+            if not latest_ts or float(newest_ts) > float(latest_ts):
+                channel_state["latest_ts"] = newest_ts
+        
+        return new_messages + new_replies
         
     except slack_sdk.errors.SlackApiError as e:
         logging.error(f"Error fetching messages for {channel_name}: {e}")
         return []
 
-def fetch_thread_replies(channel_id, thread_ts, channel_dir, threads_dict):
-    """Fetch replies for a specific thread"""
+def fetch_thread_replies(channel_id, thread_ts, threads_dict, oldest=None):
+    """Fetch replies for a specific thread, only those after `oldest` when given"""
     try:
         replies = []
         cursor = None
         
         while True:
-            response = client.conversations_replies(
-                channel=channel_id,
-                ts=thread_ts,
-                limit=100,
-                cursor=cursor
-            ) if cursor else client.conversations_replies(channel=channel_id, ts=thread_ts, limit=100)
+            params = {"channel": channel_id, "ts": thread_ts, "limit": 200}
+            if oldest:
+                params["oldest"] = oldest
+            if cursor:
+                params["cursor"] = cursor
+            response = call_slack("conversations_replies", **params)
             
             replies.extend(response["messages"])
             
             cursor = response.get("response_metadata", {}).get("next_cursor")
             if not cursor:
                 break
-                
-            # Respect rate limits
-            time.sleep(1)
+
         
         # Store replies in the dictionary
         threads_dict[thread_ts] = replies
@@ -269,7 +507,7 @@ def generate_summary_report(users, channels):
     """Generate a summary report of the data collected"""
     try:
         report = {
-            "workspace_name": client.auth_test()["team"],
+            "workspace_name": call_slack("auth_test")["team"],
             "collection_date": datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
             "num_users": len(users),
             "num_channels": len(channels),
@@ -311,7 +549,7 @@ def generate_summary_report(users, channels):
 def main():
     try:
         # Test the connection
-        response = client.auth_test()
+        response = call_slack("auth_test")
         logging.info(f"Connected to Slack workspace: {response['team']}")
 
         # join all channels
@@ -323,19 +561,9 @@ def main():
         # Fetch all channels
         channels = fetch_all_channels()
         
-        # Create directory for channel data
-        os.makedirs("slack_data/channels", exist_ok=True)
-        
-        # Fetch messages for each channel
-        for channel in channels:
-            # Skip archived channels (optional)
-            if channel.get("is_archived"):
-                logging.info(f"Skipping archived channel: {channel['name']}")
-                continue
-                
-            fetch_channel_messages(channel["id"], channel["name"])
-            # Add a delay between channel fetches to respect rate limits
-            time.sleep(2)
+        # Fetch new messages for all channels concurrently, they are in the message store once fetched
+        for _, _, commit in iter_channel_messages(channels):
+            commit()
         
         # Generate summary report
         generate_summary_report(users, channels)
@@ -352,9 +580,4 @@ if __name__ == "__main__":
     start_time = time.time()
     main()
     end_time = time.time()
-    logging.info(f"Script execution completed in {end_time - start_time:.2f} seconds")
-
-    msg = get_all_messages()
-    print()
-    print('finish')
-    print(msg)
\ No newline at end of file
+    logging.info(f"Script execution completed in {end_time - start_time:.2f} seconds")
\ No newline at end of file
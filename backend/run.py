@@ -2,5 +2,6 @@ from app import create_app
 
 app = create_app()
 
+# For concurrent chat sessions serve the ASGI app, e.g. `hypercorn run:app`
 if __name__ == '__main__':
     app.run(debug=False)
@@ -0,0 +1,32 @@
+import os
+import sys
+import importlib
+
+import pytest
+
+DATA_COLLECTOR_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "data_collector")
+
+
+@pytest.fixture(scope="session")
+def slack_collector(tmp_path_factory):
+    """ The slack_collector module, imported from a scratch directory since
+        importing it creates slack_data/ and its log file in the working
+        directory, with a dummy token so it never reaches Slack """
+    workdir = tmp_path_factory.mktemp("slack_collector")
+    cwd = os.getcwd()
+    os.environ.setdefault("SLACK_TOKEN", "xoxb-test")
+    if DATA_COLLECTOR_DIR not in sys.path:
+        sys.path.insert(0, DATA_COLLECTOR_DIR)
+    os.chdir(workdir)
+    try:
+        module = importlib.import_module("slack_collector")
+    finally:
+        os.chdir(cwd)
+    return module
+
+
+@pytest.fixture(scope="session")
+def mail_collector():
+    if DATA_COLLECTOR_DIR not in sys.path:
+        sys.path.insert(0, DATA_COLLECTOR_DIR)
+    return importlib.import_module("mail_collector")
@@ -0,0 +1,204 @@
+import os
+from types import SimpleNamespace
+
+import pytest
+from googleapiclient.errors import HttpError
+
+
+def http_error(status):
+    return HttpError(SimpleNamespace(status=status, reason="error"), b"{}")
+
+
+class Request:
+    def __init__(self, execute):
+        self.execute = execute
+
+
+class FakeGmailApi:
+    """ Stands in for gmail.service: users().getProfile(), messages().list()
+        and history().list() over an in-memory mailbox, `page_size` results
+        per page. History ids below `oldest_history_id` have expired """
+
+    def __init__(self, page_size=2):
+        self.page_size = page_size
+        self.mailbox = []  # message refs, newest first
+        self.changes = []  # (history id, message ref), oldest first
+        self.history_id = 100
+        self.oldest_history_id = 0
+        self.deleted = set()  # ids answering 404 when fetched
+        self.calls = []
+
+    def receive(self, message_id, labels=("INBOX",)):
+        self.history_id += 1
+        ref = {"id": message_id, "threadId": message_id, "labelIds": list(labels)}
+        self.mailbox.insert(0, ref)
+        self.changes.append((self.history_id, ref))
+
+    def users(self):
+        return self
+
+    def getProfile(self, userId):
+        return Request(lambda: {"historyId": str(self.history_id)})
+
+    def messages(self):
+        return SimpleNamespace(list=self.list_messages)
+
+    def history(self):
+        return SimpleNamespace(list=self.list_history)
+
+    def page(self, items, key, page_token):
+        start = int(page_token or 0)
+        end = start + self.page_size
+        response = {key: items[start:end]}
+        if end < len(items):
+            response["nextPageToken"] = str(end)
+        return response
+
+    def list_messages(self, userId, q, maxResults, pageToken):
+        self.calls.append(("messages.list", pageToken))
+        refs = [{"id": ref["id"], "threadId": ref["threadId"]} for ref in self.mailbox]
+        return Request(lambda: self.page(refs, "messages", pageToken))
+
+    def list_history(self, userId, startHistoryId, historyTypes, maxResults, pageToken):
+        self.calls.append(("history.list", startHistoryId, pageToken))
+
+        def execute():
+            if int(startHistoryId) < self.oldest_history_id:
+                raise http_error(404)
+            records = [
+                {"id": str(history_id), "messagesAdded": [{"message": ref}]}
+                for history_id, ref in self.changes if history_id > int(startHistoryId)
+            ]
+            return self.page(records, "history", pageToken)
+        return Request(execute)
+
+
+class FakeGmail:
+    """ Stands in for simplegmail.Gmail, messages deleted after being listed answer 404 """
+
+    def __init__(self, api):
+        self.service = api
+        self.creds = "credentials"
+
+    def _build_message_from_ref(self, user_id, ref, attachments="reference"):
+        if ref["id"] in self.service.deleted:
+            raise http_error(404)
+        return SimpleNamespace(id=ref["id"], subject=f"subject {ref['id']}", plain=f"body {ref['id']}")
+
+
+@pytest.fixture
+def gmail(mail_collector, monkeypatch, tmp_path):
+    api = FakeGmailApi()
+    monkeypatch.setattr(mail_collector, "get_gmail", lambda: FakeGmail(api))
+    monkeypatch.setattr(mail_collector, "Gmail", lambda credentials: FakeGmail(api))
+    monkeypatch.setattr(mail_collector, "SYNC_STATE_FILE", str(tmp_path / "gmail_sync_state.json"))
+    return api
+
+
+def collect(mail_collector):
+    return [message.id for message in mail_collector.iter_gmail_messages()]
+
+
+def test_first_run_lists_the_mailbox_and_saves_state_once_exhausted(mail_collector, gmail):
+    for message_id in ("m1", "m2", "m3"):
+        gmail.receive(message_id)
+
+    messages = mail_collector.iter_gmail_messages()
+    assert next(messages).id == "m3"
+    assert not os.path.exists(mail_collector.SYNC_STATE_FILE)
+    assert [message.id for message in messages] == ["m2", "m1"]
+
+    assert mail_collector.load_sync_state() == {"history_id": "103", "last_message_id": "m3"}
+    assert [call[0] for call in gmail.calls] == ["messages.list", "messages.list"]
+
+
+def test_next_run_reads_the_history_since_the_saved_id(mail_collector, gmail):
+    gmail.receive("m1")
+    collect(mail_collector)
+    gmail.calls.clear()
+
+    gmail.receive("m2")
+    gmail.receive("draft", labels=("DRAFT",))
+    gmail.receive("m3")
+
+    assert collect(mail_collector) == ["m2", "m3"]
+    assert gmail.calls == [("history.list", "101", None), ("history.list", "101", "2")]
+    assert mail_collector.load_sync_state() == {"history_id": "104", "last_message_id": "m3"}
+
+
+def test_expired_history_lists_down_to_the_last_message_seen(mail_collector, gmail):
+    for message_id in ("m1", "m2", "m3", "m4", "m5"):
+        gmail.receive(message_id)
+    collect(mail_collector)
+    gmail.calls.clear()
+
+    gmail.receive("m6")
+    gmail.receive("m7")
+    gmail.oldest_history_id = 1000
+
+    assert collect(mail_collector) == ["m7", "m6"]
+    # listing stops at the page holding m5 instead of walking the whole mailbox
+    assert gmail.calls == [("history.list", "105", None), ("messages.list", None), ("messages.list", "2")]
+    assert mail_collector.load_sync_state() == {"history_id": "107", "last_message_id": "m7"}
+
+
+def test_message_deleted_before_its_fetch_is_skipped(mail_collector, gmail):
+    for message_id in ("m1", "m2", "m3"):
+        gmail.receive(message_id)
+    gmail.deleted.add("m2")
+
+    assert collect(mail_collector) == ["m3", "m1"]
+    assert mail_collector.load_sync_state()["history_id"] == "103"
+
+
+def test_other_fetch_errors_stop_without_saving_state(mail_collector, gmail, monkeypatch):
+    gmail.receive("m1")
+
+    class FailingGmail(FakeGmail):
+        def _build_message_from_ref(self, user_id, ref, attachments="reference"):
+            raise http_error(500)
+    monkeypatch.setattr(mail_collector, "Gmail", lambda credentials: FailingGmail(gmail))
+
+    with pytest.raises(HttpError):
+        collect(mail_collector)
+    assert not os.path.exists(mail_collector.SYNC_STATE_FILE)
+
+
+def test_new_state_goes_to_the_given_save_state(mail_collector, gmail):
+    gmail.receive("m1")
+    saved = []
+
+    assert [message.id for message in mail_collector.iter_gmail_messages(save_state=saved.append)] == ["m1"]
+    assert saved == [{"history_id": "101", "last_message_id": "m1"}]
+    assert not os.path.exists(mail_collector.SYNC_STATE_FILE)
+
+
+def body(text):
+    return SimpleNamespace(plain=text, html=None, snippet="snippet")
+
+
+@pytest.mark.parametrize("text, expected", [
+    ("Hi team,\nThe unsubscribe flow for the newsletter is broken.",
+     "Hi team,\nThe unsubscribe flow for the newsletter is broken."),
+    ("Status update\nCopyright 2024 matters for our licensing doc\nmore text",
+     "Status update\nCopyright 2024 matters for our licensing doc\nmore text"),
+    ("Hello\nThis message is confidential unless stated\nbody continues",
+     "Hello\nThis message is confidential unless stated\nbody continues"),
+    ("Hi,\nFrom: the sales side we need numbers.\nBye", "Hi,\nFrom: the sales side we need numbers.\nBye"),
+    ("Thanks!\n\nFrom: Bob <bob@example.com>\nSent: Monday\nTo: me\nSubject: numbers\n\nold text", "Thanks!"),
+    ("Sounds good\n\nOn Mon, Jan 1, 2024 at 10:00 AM Bob <bob@example.com>\nwrote:\n> old text", "Sounds good"),
+    ("Sounds good\n> quoted\nmine again", "Sounds good\nmine again"),
+    ("News body\nmore\nstuff\n\nUnsubscribe | Manage preferences <https://example.com/u>\nAcme Inc", "News body\nmore\nstuff"),
+    ("Body\nmore\n\nThis email and any attachments are confidential.\nCopyright 2024 Acme", "Body\nmore"),
+    ("Hello\nSee you\nSent from my iPhone", "Hello\nSee you"),
+    ("Thanks\n-- \nBob\nCEO", "Thanks"),
+    ("See [image: logo.png] the report <https://example.com/track>", "See  the report"),
+])
+def test_clean_body(mail_collector, text, expected):
+    assert mail_collector.clean_body(body(text)) == expected
+
+
+def test_clean_body_falls_back_to_html_and_snippet(mail_collector):
+    html = SimpleNamespace(plain=None, html="<style>p {}</style><p>Hello &amp; welcome</p>", snippet="snippet")
+    assert mail_collector.clean_body(html) == "Hello & welcome"
+    assert mail_collector.clean_body(SimpleNamespace(plain=None, html=None, snippet="snippet")) == "snippet"
@@ -0,0 +1,132 @@
+import pytest
+
+CHANNEL = "C001"
+LOOKBACK = 30 * 24 * 60 * 60
+BASE = 1_700_000_000
+
+
+def ts(seconds):
+    return f"{seconds:.6f}"
+
+def message(seconds, **fields):
+    return {"ts": ts(seconds), "user": "U001", "text": f"message {seconds}", **fields}
+
+
+class FakeSlack:
+    """ Stands in for slack_sdk.WebClient, answering conversations_history and
+        conversations_replies from in-memory channels, `page_size` messages
+        per page like the Web API's cursor pagination """
+
+    def __init__(self, page_size=2):
+        self.page_size = page_size
+        self.history = {}  # channel -> messages, newest first
+        self.threads = {}  # (channel, thread_ts) -> replies, oldest first
+        self.calls = []
+
+    def post(self, channel, seconds):
+        self.history.setdefault(channel, []).insert(0, message(seconds))
+
+    def post_thread(self, channel, seconds, reply_seconds):
+        self.history.setdefault(channel, []).insert(0, message(seconds, thread_ts=ts(seconds)))
+        self.threads[(channel, ts(seconds))] = []
+        for reply in reply_seconds:
+            self.reply(channel, seconds, reply)
+
+    def reply(self, channel, thread_seconds, seconds):
+        self.threads[(channel, ts(thread_seconds))].append(message(seconds, thread_ts=ts(thread_seconds)))
+        for msg in self.history[channel]:
+            if msg["ts"] == ts(thread_seconds):
+                msg["reply_count"] = msg.get("reply_count", 0) + 1
+                msg["latest_reply"] = ts(seconds)
+
+    def page(self, messages, cursor):
+        start = int(cursor or 0)
+        end = start + self.page_size
+        next_cursor = str(end) if end < len(messages) else ""
+        return {"messages": messages[start:end], "response_metadata": {"next_cursor": next_cursor}}
+
+    def conversations_history(self, channel, limit, oldest=None, cursor=None):
+        self.calls.append(("conversations_history", channel, oldest))
+        messages = [msg for msg in self.history.get(channel, []) if not oldest or float(msg["ts"]) > float(oldest)]
+        return self.page(messages, cursor)
+
+    def conversations_replies(self, channel, ts, limit, oldest=None, cursor=None):
+        self.calls.append(("conversations_replies", ts, oldest))
+        head = [msg for msg in self.history[channel] if msg["ts"] == ts]
+        replies = [msg for msg in self.threads[(channel, ts)] if not oldest or float(msg["ts"]) > float(oldest)]
+        return self.page(head + replies, cursor)
+
+
+@pytest.fixture
+def slack(slack_collector, monkeypatch, tmp_path):
+    fake = FakeSlack()
+    monkeypatch.setattr(slack_collector, "client", fake)
+    monkeypatch.setattr(slack_collector, "SYNC_STATE_FILE", str(tmp_path / "sync_state.json"))
+    monkeypatch.setattr(slack_collector, "MESSAGES_DIR", str(tmp_path / "messages"))
+    return fake
+
+
+def fetch(slack_collector, state):
+    return slack_collector.fetch_channel_messages(CHANNEL, "general", state)
+
+
+def test_first_run_fetches_everything_and_sets_high_water_marks(slack_collector, slack):
+    slack.post(CHANNEL, BASE + 1)
+    slack.post_thread(CHANNEL, BASE + 2, [BASE + 3, BASE + 4])
+    slack.post(CHANNEL, BASE + 5)
+
+    state = {}
+    fetched = fetch(slack_collector, state)
+
+    # new messages newest first, then the thread replies without their parent
+    assert [msg["ts"] for msg in fetched] == [ts(BASE + s) for s in (5, 2, 1, 3, 4)]
+    assert state["latest_ts"] == ts(BASE + 5)
+    assert state["threads"] == {ts(BASE + 2): ts(BASE + 4)}
+    assert slack.calls[0] == ("conversations_history", CHANNEL, None)
+    assert len(slack_collector.load_messages(["ts"], channel_id=CHANNEL)) == 5
+
+
+def test_next_run_only_fetches_new_messages_and_replies(slack_collector, slack):
+    slack.post(CHANNEL, BASE + 1)
+    slack.post_thread(CHANNEL, BASE + 2, [BASE + 3])
+    slack.post_thread(CHANNEL, BASE + 4, [BASE + 5])
+    state = {}
+    fetch(slack_collector, state)
+    slack.calls.clear()
+
+    slack.post(CHANNEL, BASE + 10)
+    slack.reply(CHANNEL, BASE + 2, BASE + 11)
+    fetched = fetch(slack_collector, state)
+
+    assert [msg["ts"] for msg in fetched] == [ts(BASE + 10), ts(BASE + 11)]
+    # parents within the lookback are read again to notice new replies
+    assert slack.calls[0] == ("conversations_history", CHANNEL, str(float(ts(BASE + 4)) - LOOKBACK))
+    # but only the thread whose latest_reply moved is fetched, from its last seen reply on
+    assert [call for call in slack.calls if call[0] == "conversations_replies"] == [
+        ("conversations_replies", ts(BASE + 2), ts(BASE + 3))
+    ]
+    assert state["latest_ts"] == ts(BASE + 10)
+    assert state["threads"] == {ts(BASE + 2): ts(BASE + 11), ts(BASE + 4): ts(BASE + 5)}
+
+
+def test_run_without_activity_fetches_nothing(slack_collector, slack):
+    slack.post(CHANNEL, BASE + 1)
+    slack.post_thread(CHANNEL, BASE + 2, [BASE + 3])
+    state = {}
+    fetch(slack_collector, state)
+    slack.calls.clear()
+
+    assert fetch(slack_collector, state) == []
+    assert [call[0] for call in slack.calls] == ["conversations_history"]
+
+
+def test_channel_state_is_saved_on_commit_only(slack_collector, slack):
+    slack.post(CHANNEL, BASE + 1)
+    channels = [{"id": CHANNEL, "name": "general"}, {"id": "C002", "name": "old", "is_archived": True}]
+
+    results = list(slack_collector.iter_channel_messages(channels))
+
+    assert [(channel["id"], len(messages)) for channel, messages, _ in results] == [(CHANNEL, 1)]
+    assert slack_collector.load_sync_state() == {}
+    results[0][2]()
+    assert slack_collector.load_sync_state()[CHANNEL]["latest_ts"] == ts(BASE + 1)
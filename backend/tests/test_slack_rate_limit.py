@@ -0,0 +1,98 @@
+from types import SimpleNamespace
+
+import pytest
+
+
+class FakeClock:
+    """ Replaces the time module of slack_collector, sleeping only moves the clock """
+
+    def __init__(self):
+        self.now = 1000.0
+        self.sleeps = []
+
+    def monotonic(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.sleeps.append(seconds)
+        self.now += seconds
+
+
+class RateLimitedSlack:
+    """ Answers conversations_history with a 429 and a Retry-After header
+        for the first `limited` calls, then with an empty page """
+
+    def __init__(self, errors, limited, retry_after="3", status_code=429):
+        self.errors = errors
+        self.limited = limited
+        self.retry_after = retry_after
+        self.status_code = status_code
+        self.calls = []
+
+    def conversations_history(self, **params):
+        self.calls.append(params)
+        if len(self.calls) <= self.limited:
+            headers = {"Retry-After": self.retry_after} if self.retry_after else {}
+            response = SimpleNamespace(status_code=self.status_code, headers=headers)
+            raise self.errors.SlackApiError("ratelimited", response)
+        return {"ok": True, "messages": []}
+
+
+@pytest.fixture
+def clock(slack_collector, monkeypatch):
+    fake = FakeClock()
+    monkeypatch.setattr(slack_collector, "time", fake)
+    monkeypatch.setattr(slack_collector, "buckets", {})
+    return fake
+
+
+def test_bucket_spends_its_burst_then_waits_for_refills(slack_collector, clock):
+    bucket = slack_collector.TokenBucket(60, burst=2)
+
+    bucket.acquire()
+    bucket.acquire()
+    assert clock.sleeps == []
+    bucket.acquire()
+    assert clock.now == pytest.approx(1001.0)
+
+
+def test_paused_bucket_holds_callers_back(slack_collector, clock):
+    bucket = slack_collector.TokenBucket(600, burst=10)
+
+    bucket.pause(5)
+    bucket.acquire()
+
+    assert clock.now >= 1005.0
+
+
+def test_call_slack_pauses_for_retry_after_and_retries(slack_collector, clock, monkeypatch):
+    slack = RateLimitedSlack(slack_collector.slack_sdk.errors, limited=2, retry_after="3")
+    monkeypatch.setattr(slack_collector, "client", slack)
+
+    response = slack_collector.call_slack("conversations_history", channel="C001", limit=200)
+
+    assert response == {"ok": True, "messages": []}
+    assert len(slack.calls) == 3
+    assert all(params == {"channel": "C001", "limit": 200} for params in slack.calls)
+    # each 429 paused the method's bucket for Retry-After seconds
+    assert clock.now >= 1000.0 + 2 * 3
+    assert slack_collector.buckets["conversations_history"].paused_until >= 1000.0 + 2 * 3
+
+
+def test_call_slack_gives_up_after_max_retries(slack_collector, clock, monkeypatch):
+    slack = RateLimitedSlack(slack_collector.slack_sdk.errors, limited=slack_collector.MAX_RETRIES, retry_after="1")
+    monkeypatch.setattr(slack_collector, "client", slack)
+
+    with pytest.raises(slack_collector.slack_sdk.errors.SlackApiError):
+        slack_collector.call_slack("conversations_history", channel="C001")
+    assert len(slack.calls) == slack_collector.MAX_RETRIES
+
+
+def test_call_slack_does_not_retry_other_errors(slack_collector, clock, monkeypatch):
+    slack = RateLimitedSlack(slack_collector.slack_sdk.errors, limited=1, status_code=500)
+    monkeypatch.setattr(slack_collector, "client", slack)
+
+    with pytest.raises(slack_collector.slack_sdk.errors.SlackApiError):
+        slack_collector.call_slack("conversations_history", channel="C001")
+    assert len(slack.calls) == 1
+    assert clock.sleeps == []
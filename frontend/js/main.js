@@ -6,6 +6,9 @@ const reportBtn = document.getElementById('report-btn');
 let canGenerateReport = false;
 let welcomeShown = true;
 let chat = []; // Store chat history for the API
+// Employee the answers are scoped to, set with localStorage.setItem('employeeId', ...).
+// The backend does not authenticate it yet, without one it uses its anonymous scope
+const employeeId = localStorage.getItem('employeeId');
 
 // Adjust textarea height based on content
 chatInput.addEventListener('input', function() {
@@ -61,62 +64,76 @@ async function sendMessage() {
     chatContainer.scrollTop = chatContainer.scrollHeight;
 
     try {
-        // Call the backend API
-        const response = await fetch('http://127.0.0.1:5000/neurocorp', {
+        // Call the backend API, agent progress and the report arrive as NDJSON events
+        const response = await fetch('http://127.0.0.1:5000/neurocorp/stream', {
             method: 'POST',
             headers: { 'Content-Type': 'application/json' },
             body: JSON.stringify({
-                messages: chat
+                messages: chat,
+                ...(employeeId && { employee_id: employeeId })
             })
         });
-        
-        const data = await response.json();
-        console.log(data);
-        reportData = data.final_report;
-        console.log(reportData);
-        
-        // Remove thinking indicator
-        chatContainer.removeChild(thinkingEl);
-        
-        // Technical analysis response
-        if (data.technical_analysis) {
-            const technicalMsg = document.createElement('div');
-            technicalMsg.className = 'message assistant visible';
-            technicalMsg.innerHTML = `
-                <div class="avatar-container technical">TA</div>
-                <div class="message-content">
-                    <strong>Technical Analysis:</strong><br>
-                    ${formatMarkdown(data.technical_analysis)}
-                </div>
-            `;
-            chatContainer.appendChild(technicalMsg);
-            chat.push(['technical_analyst', data.technical_analysis]);
-        }
-        
-        // Business analysis response
-        if (data.business_analysis) {
-            const businessMsg = document.createElement('div');
-            businessMsg.className = 'message assistant visible';
-            businessMsg.innerHTML = `
-                <div class="avatar-container business">BA</div>
-                <div class="message-content">
-                    <strong>Business Analysis:</strong><br>
-                    ${formatMarkdown(data.business_analysis)}
-                </div>
-            `;
-            chatContainer.appendChild(businessMsg);
-            chat.push(['business_analyst', data.business_analysis]);
+        if (!response.ok || !response.body) {
+            throw new Error(`Backend responded with ${response.status}`);
         }
+
+        const agentSteps = thinkingEl.querySelectorAll('.agent');
+        let technicalShown = false;
+        let businessShown = false;
+        let reportContent = null;
+        let reportText = '';
+
+        const showTechnical = (analysis) => {
+            appendAgentMessage('technical', 'TA', 'Technical Analysis', analysis);
+            chat.push(['technical_analyst', analysis]);
+            technicalShown = true;
+        };
+        const showBusiness = (analysis) => {
+            appendAgentMessage('business', 'BA', 'Business Analysis', analysis);
+            chat.push(['business_analyst', analysis]);
+            businessShown = true;
+        };
+
+        await readEvents(response, (event) => {
+            if (event.event === 'node_finished' && event.node === 'technical_analyst') {
+                markStepDone(agentSteps[0]);
+                showTechnical(event.technical_analysis);
+            } else if (event.event === 'node_finished' && event.node === 'business_analyst') {
+                markStepDone(agentSteps[1]);
+                showBusiness(event.business_analysis);
+            } else if (event.event === 'report_token') {
+                // Render the report as it is generated
+                if (!reportContent) {
+                    thinkingEl.remove();
+                    reportContent = appendAgentMessage('technical', 'FR', 'Final Report', '');
+                }
+                reportText += event.content;
+                reportContent.innerHTML = `<strong>Final Report:</strong><br>${formatMarkdown(reportText)}`;
+            } else if (event.event === 'done') {
+                // Cached answers arrive in this single event
+                const data = event.result;
+                thinkingEl.remove();
+                if (!technicalShown && data.technical_analysis) showTechnical(data.technical_analysis);
+                if (!businessShown && data.business_analysis) showBusiness(data.business_analysis);
+                if (!reportContent && data.final_report) {
+                    appendAgentMessage('technical', 'FR', 'Final Report', data.final_report);
+                }
+                reportData = data.final_report;
+            } else if (event.event === 'error') {
+                throw new Error(event.error);
+            }
+            chatContainer.scrollTop = chatContainer.scrollHeight;
+        });
         
         // Enable report generation if available
-        canGenerateReport = true;
-        reportBtn.disabled = false;
+        canGenerateReport = Boolean(reportData);
+        reportBtn.disabled = !canGenerateReport;
         
     } catch (err) {
         console.error(err);
         
         // Remove thinking indicator and show error
-        chatContainer.removeChild(thinkingEl);
+        thinkingEl.remove();
         
         const errorMsg = document.createElement('div');
         errorMsg.className = 'message assistant visible';
@@ -174,6 +191,47 @@ async function generateReport() {
     chatContainer.scrollTop = chatContainer.scrollHeight;
 }
 
+// Read an NDJSON response as it streams in, calling onEvent for every line
+async function readEvents(response, onEvent) {
+    const reader = response.body.getReader();
+    const decoder = new TextDecoder();
+    let buffer = '';
+
+    while (true) {
+        const { value, done } = await reader.read();
+        if (done) break;
+        buffer += decoder.decode(value, { stream: true });
+        const lines = buffer.split('\n');
+        buffer = lines.pop();
+        for (const line of lines) {
+            if (line.trim()) onEvent(JSON.parse(line));
+        }
+    }
+    if (buffer.trim()) onEvent(JSON.parse(buffer));
+}
+
+// Add an agent message to the chat and return its content element
+function appendAgentMessage(avatarClass, initials, title, text) {
+    const messageEl = document.createElement('div');
+    messageEl.className = 'message assistant visible';
+    messageEl.innerHTML = `
+        <div class="avatar-container ${avatarClass}">${initials}</div>
+        <div class="message-content">
+            <strong>${title}:</strong><br>
+            ${formatMarkdown(text)}
+        </div>
+    `;
+    chatContainer.appendChild(messageEl);
+    return messageEl.querySelector('.message-content');
+}
+
+// Replace the spinner of a finished agent step with a check mark
+function markStepDone(stepEl) {
+    if (!stepEl) return;
+    const icon = stepEl.querySelector('i');
+    if (icon) icon.className = 'fas fa-check';
+}
+
 // Function to format markdown-style text
 function formatMarkdown(text) {
     // Convert **text** to <strong>text</strong>